@@ -0,0 +1,339 @@
+import numpy as np
+from scipy.interpolate import CubicSpline, PPoly
+from intersections import _segment_intersection_
+
+"""
+Boundary: an (r,z) curve stored as one contiguous (M,2) array. Quantities
+that the shape functions derive from the curve (ccw ordering, arc length,
+extremal points, segment bounding boxes) are computed on first use and
+cached on the object.
+
+BoundarySpline: compact periodic spline representation of a closed Boundary,
+that can be evaluated at any resolution.
+"""
+
+class Boundary:
+    """
+    CLASS: Boundary
+    DESCRIPTION: (r,z) points of a curve, rz has shape (M,2). ccw=True marks
+    points that are already sorted counter-clockwise (see sort_ccw), so that
+    they are not sorted again. Unpacks as r, z = boundary.
+    """
+    __slots__ = ('rz', 'ccw', '_center', '_arclength', '_extrema', '_bbox', '_blockbox')
+
+    def __init__(self, r, z=None, ccw=False):
+        if z is None:
+            rz = np.ascontiguousarray(r, dtype=float)
+        else:
+            rz = np.empty((len(r), 2))
+            rz[:,0] = r
+            rz[:,1] = z
+        self.rz = rz
+        self.ccw = ccw
+        self._center = None
+        self._arclength = None
+        self._extrema = None
+        self._bbox = None
+        self._blockbox = None
+
+    @property
+    def r(self):
+        return self.rz[:,0]
+
+    @property
+    def z(self):
+        return self.rz[:,1]
+
+    def __len__(self):
+        return self.rz.shape[0]
+
+    def __iter__(self):
+        yield self.r
+        yield self.z
+
+    def __getstate__(self):
+        return self.rz, self.ccw
+
+    def __setstate__(self, state):
+        self.__init__(state[0], ccw=state[1])
+
+    @property
+    def closed(self):
+        return bool(np.all(self.rz[0] == self.rz[-1]))
+
+    @property
+    def center(self):
+        """mean of the points, the center for ccw sorting"""
+        if self._center is None:
+            self._center = self.rz.mean(axis=0)
+        return self._center
+
+    @property
+    def arclength(self):
+        """cumulative arc length, starting at 0"""
+        if self._arclength is None:
+            lens = np.sqrt(np.sum(np.diff(self.rz, axis=0)**2, axis=1))
+            self._arclength = np.concatenate(([0.0], np.cumsum(lens)))
+        return self._arclength
+
+    @property
+    def extrema(self):
+        """indices of the inner, outer, upper and lower points"""
+        if self._extrema is None:
+            r, z = self.r, self.z
+            self._extrema = {'i': np.argmin(r), 'o': np.argmax(r),
+                             'u': np.argmax(z), 'l': np.argmin(z)}
+        return self._extrema
+
+    @property
+    def bbox(self):
+        """bounding box (rmin, rmax, zmin, zmax) of each segment, shape (M-1,4)"""
+        if self._bbox is None:
+            a, b = self.rz[:-1], self.rz[1:]
+            lo = np.minimum(a, b)
+            hi = np.maximum(a, b)
+            self._bbox = np.c_[lo[:,0], hi[:,0], lo[:,1], hi[:,1]]
+        return self._bbox
+
+    def blockbox(self, size=64):
+        """
+        bounding box (rmin, rmax, zmin, zmax) of each block of size 
+        consecutive segments (the last block may be shorter), shape (K,4)
+        """
+        if self._blockbox is None or self._blockbox[0] != size:
+            box = self.bbox
+            nblocks = -(-len(box) // size)
+            pad = np.tile([np.inf, -np.inf, np.inf, -np.inf], (nblocks*size - len(box), 1))
+            box = np.r_[box, pad].reshape(nblocks, size, 4)
+            blocks = np.c_[box[:,:,0].min(axis=1), box[:,:,1].max(axis=1),
+                           box[:,:,2].min(axis=1), box[:,:,3].max(axis=1)]
+            self._blockbox = (size, blocks)
+        return self._blockbox[1]
+
+    def loop(self):
+        """the boundary with the first point appended at the end, if not already closed"""
+        if self.closed:
+            return self
+        rz = np.empty((len(self)+1, 2))
+        rz[:-1] = self.rz
+        rz[-1] = self.rz[0]
+        return Boundary(rz, ccw=self.ccw)
+
+    def sort_ccw(self):
+        """the boundary sorted counter-clockwise about its center"""
+        if self.ccw:
+            return self
+        cx, cy = self.center
+        angles = np.arctan2(self.z - cy, -self.r + cx)
+        i = np.argsort(-angles)
+        return Boundary(self.rz[i], ccw=True)
+
+    def hits(self, x, y):
+        """
+        Candidate intersections of each segment of the curve (x,y) with the
+        boundary. Returns the segment indices (i on the curve, j on the boundary)
+        and the intersection parameters T, see intersections._segment_intersection_.
+        """
+        x = np.asarray(x)
+        y = np.asarray(y)
+        xmin, xmax = np.minimum(x[:-1], x[1:]), np.maximum(x[:-1], x[1:])
+        ymin, ymax = np.minimum(y[:-1], y[1:]), np.maximum(y[:-1], y[1:])
+        box = self.bbox
+
+        C = ((xmin[:,None] <= box[None,:,1]) & (xmax[:,None] >= box[None,:,0]) &
+             (ymin[:,None] <= box[None,:,3]) & (ymax[:,None] >= box[None,:,2]))
+        ii, jj = np.nonzero(C)
+
+        T = _segment_intersection_(x, y, self.r, self.z, ii, jj)
+        in_range = (T[0, :] >= 0) & (T[1, :] >= 0) & (
+            T[0, :] <= 1) & (T[1, :] <= 1)
+        return ii[in_range], jj[in_range], T[:, in_range]
+
+    def intersection(self, x, y):
+        """(r,z) locations where the curve (x,y) intersects the boundary"""
+        _, _, T = self.hits(x, y)
+        return T[2], T[3]
+
+
+class BoundarySpline:
+    """
+    CLASS: BoundarySpline
+    DESCRIPTION: cubic spline through a subset of the points (knots) of a 
+    closed boundary, parametrized by the normalized arc length t of the 
+    original boundary, 0 <= t < 1. The spline is periodic and twice 
+    differentiable, except at corner knots (e.g. x-points) where it is only
+    continuous. err is the largest distance between the spline and the
+    original boundary polyline.
+    """
+    __slots__ = ('t', 'rz', 'corners', 'err', '_spline', '_x0', '_bezier')
+
+    def __init__(self, t, rz, corners=(), err=np.nan):
+        self.t = np.asarray(t, dtype=float)
+        self.rz = np.asarray(rz, dtype=float)
+        self.corners = np.asarray(corners, dtype=int)
+        self.err = err
+        self._spline, self._x0 = self._piecewise_spline(self.t, self.rz, self.corners)
+        self._bezier = None
+
+    @staticmethod
+    def _piecewise_spline(t, rz, corners):
+        """
+        PPoly through the knots, and the parameter value where it starts
+        """
+        if corners.size == 0:
+            return CubicSpline(np.append(t, 1.0), np.vstack((rz, rz[:1])), bc_type='periodic'), 0.0
+
+        # once around the boundary starting from the first corner, with a
+        # separate spline between each pair of corners
+        K = len(t)
+        c0 = corners[0]
+        i = np.r_[np.arange(c0, K), np.arange(0, c0+1)]
+        tt = np.r_[t[c0:], t[:c0+1] + 1]
+        cuts = np.append(np.sort((corners - c0) % K), K)
+
+        c, x = [], [tt[:1]]
+        for a, b in zip(cuts[:-1], cuts[1:]):
+            spline = CubicSpline(tt[a:b+1], rz[i[a:b+1]])
+            c.append(spline.c)
+            x.append(spline.x[1:])
+        return PPoly(np.concatenate(c, axis=1), np.concatenate(x)), tt[0]
+
+    @classmethod
+    def from_boundary(cls, b, tol=5e-4, corner_angle=10, nknots=16, maxknots=250):
+        """
+        Fit a spline to the closed Boundary b. Points where the boundary turns 
+        by more than corner_angle [deg] are corners. Knots are added one at a 
+        time where the error is largest, until it is below tol [m] or there 
+        are maxknots knots.
+        """
+        b = b.loop()
+        t = b.arclength / b.arclength[-1]
+        n = len(b) - 1
+        t, rz = t[:-1], b.rz[:-1]
+
+        # corners from the turning angle at each point
+        d = np.diff(b.rz, axis=0)
+        angle = np.arctan2(d[:,1], d[:,0])
+        turn = np.angle(np.exp(1j*(angle - np.roll(angle, 1))))
+        icorners = np.nonzero(np.abs(turn) > np.radians(corner_angle))[0]
+
+        # the error is checked at the points and at the segment midpoints
+        tcheck = np.c_[t, t + np.diff(b.arclength)/b.arclength[-1]/2].ravel()
+        rzcheck = np.c_[rz, (rz + b.rz[1:])/2].reshape(-1, 2)
+
+        iknots = np.union1d(np.linspace(0, n, nknots+1)[:-1].astype(int), icorners)
+        while True:
+            corners = np.searchsorted(iknots, icorners)
+            spline = cls(t[iknots], rz[iknots], corners)
+            err = np.sqrt(np.sum((spline(tcheck) - rzcheck)**2, axis=1))
+            if err.max() <= tol or len(iknots) >= maxknots:
+                break
+
+            # one new knot at the largest error that is not a knot yet
+            inew = ((np.argsort(-err) + 1) // 2) % n
+            inew = inew[~np.isin(inew, iknots)]
+            if inew.size == 0:
+                break
+            iknots = np.union1d(iknots, inew[:1])
+
+        spline.err = err.max()
+        return spline
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['t'], np.c_[d['r'], d['z']], d.get('corners', []), d.get('err', np.nan))
+
+    def to_dict(self):
+        """knots and corners, for saving to file"""
+        return {'t': self.t.tolist(), 'r': self.rz[:,0].tolist(), 'z': self.rz[:,1].tolist(),
+                'corners': self.corners.tolist(), 'err': float(self.err)}
+
+    def __len__(self):
+        return len(self.t)
+
+    def __call__(self, t):
+        """(r,z) at normalized arc length positions t, shape (len(t),2)"""
+        return self._spline(self._x0 + np.mod(np.asarray(t) - self._x0, 1.0))
+
+    def resample(self, n=500):
+        """closed Boundary with n points evenly spaced in t"""
+        rz = np.empty((n+1, 2))
+        rz[:n] = self(np.linspace(0, 1, n+1)[:-1])
+        rz[n] = rz[0]
+        return Boundary(rz)
+
+    @property
+    def bezier(self):
+        """
+        Bezier control points of each spline piece, shape (K,4,2). Each piece
+        lies inside the bounding box of its control points.
+        """
+        if self._bezier is None:
+            c = self._spline.c
+            h = np.diff(self._spline.x)[:,None]
+            a, B, C, D = c[3], c[2]*h, c[1]*h**2, c[0]*h**3
+            self._bezier = np.stack((a, a + B/3, a + 2*B/3 + C/3, a + B + C + D), axis=1)
+        return self._bezier
+
+    def seg_intersections(self, segs, nsamples=8, niter=4):
+        """
+        Intersection of control segments with the spline. Like
+        shape_callbacks.seg_intersections, the first crossing along the
+        boundary is used for segments that cross more than once.
+        """
+        nsegs = segs.shape[0]
+        rcp = np.empty(nsegs)*np.nan
+        zcp = np.empty(nsegs)*np.nan
+
+        # candidate (segment, piece) pairs from bounding boxes
+        P = self.bezier
+        plo, phi = P.min(axis=1), P.max(axis=1)
+        slo = np.minimum(segs[:,0:2], segs[:,2:4])
+        shi = np.maximum(segs[:,0:2], segs[:,2:4])
+        C = np.all((slo[:,None,:] <= phi[None,:,:]) & (shi[:,None,:] >= plo[None,:,:]), axis=2)
+        iseg, k = np.nonzero(C)
+        if iseg.size == 0:
+            return rcp, zcp
+
+        # side of the segment line, as a cubic in the piece parameter s in [0,1]
+        x = self._spline.x
+        h = np.diff(x)[k]
+        c = self._spline.c[:, k, :]
+        A = segs[iseg, 0:2]
+        d = segs[iseg, 2:4] - A
+        coef = [c[0]*h[:,None]**3, c[1]*h[:,None]**2, c[2]*h[:,None], c[3] - A]
+        coef = [p[:,1]*d[:,0] - p[:,0]*d[:,1] for p in coef]
+
+        # bracket the sign changes, then refine all roots at once with
+        # Newton steps from the secant guess, kept inside the brackets
+        s = np.linspace(0, 1, nsamples+1)
+        F = ((coef[0]*s[:,None] + coef[1])*s[:,None] + coef[2])*s[:,None] + coef[3]
+        isamp, ipair = np.nonzero(np.sign(F[:-1]) * np.sign(F[1:]) <= 0)
+        c3, c2, c1, c0 = [p[ipair] for p in coef]
+
+        lo, hi = s[isamp], s[isamp+1]
+        flo, fhi = F[isamp, ipair], F[isamp+1, ipair]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sroot = np.where(fhi != flo, lo - flo * (hi - lo) / (fhi - flo), lo)
+            for _ in range(niter):
+                f = ((c3*sroot + c2)*sroot + c1)*sroot + c0
+                df = (3*c3*sroot + 2*c2)*sroot + c1
+                sroot = np.clip(np.where(df != 0, sroot - f / df, sroot), lo, hi)
+
+        # keep the roots that are on the segment
+        xroot = x[k[ipair]] + sroot * h[ipair]
+        rz = self._spline(xroot)
+        A, d = A[ipair], d[ipair]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            u = np.sum((rz - A) * d, axis=1) / np.sum(d**2, axis=1)
+        on = (u >= 0) & (u <= 1)
+
+        # first root along the boundary for each segment
+        tt = np.mod(xroot[on], 1.0)
+        js = iseg[ipair][on]
+        rz = rz[on]
+        order = np.lexsort((tt, js))
+        first, i = np.unique(js[order], return_index=True)
+        rcp[first] = rz[order][i,0]
+        zcp[first] = rz[order][i,1]
+        return rcp, zcp
@@ -33,6 +33,30 @@ def _rectangle_intersection_(x1, y1, x2, y2):
     return ii, jj
 
 
+def _segment_intersection_(x1, y1, x2, y2, ii, jj):
+    n = len(ii)
+
+    dxy1 = np.diff(np.c_[x1, y1], axis=0)
+    dxy2 = np.diff(np.c_[x2, y2], axis=0)
+
+    # solve the 2x2 system for each candidate pair of segments at once
+    # (Cramer's rule), parallel segments are flagged with T = inf
+    dx1, dy1 = dxy1[ii, 0], dxy1[ii, 1]
+    dx2, dy2 = dxy2[jj, 0], dxy2[jj, 1]
+    ex = x2[jj].ravel() - x1[ii].ravel()
+    ey = y2[jj].ravel() - y1[ii].ravel()
+    det = dx2 * dy1 - dx1 * dy2
+
+    T = np.full((4, n), np.inf)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ok = det != 0
+        T[0, ok] = (dx2[ok] * ey[ok] - dy2[ok] * ex[ok]) / det[ok]
+        T[1, ok] = (dx1[ok] * ey[ok] - dy1[ok] * ex[ok]) / det[ok]
+    T[2, :] = x1[ii].ravel() + dx1 * T[0, :]
+    T[3, :] = y1[ii].ravel() + dy1 * T[0, :]
+    return T
+
+
 def intersection(x1, y1, x2, y2):
     """
 INTERSECTIONS Intersections of curves.
@@ -64,29 +88,7 @@ x,y=intersection(x1,y1,x2,y2)
     y2 = np.asarray(y2)
 
     ii, jj = _rectangle_intersection_(x1, y1, x2, y2)
-    n = len(ii)
-
-    dxy1 = np.diff(np.c_[x1, y1], axis=0)
-    dxy2 = np.diff(np.c_[x2, y2], axis=0)
-
-    T = np.zeros((4, n))
-    AA = np.zeros((4, 4, n))
-    AA[0:2, 2, :] = -1
-    AA[2:4, 3, :] = -1
-    AA[0::2, 0, :] = dxy1[ii, :].T
-    AA[1::2, 1, :] = dxy2[jj, :].T
-
-    BB = np.zeros((4, n))
-    BB[0, :] = -x1[ii].ravel()
-    BB[1, :] = -x2[jj].ravel()
-    BB[2, :] = -y1[ii].ravel()
-    BB[3, :] = -y2[jj].ravel()
-
-    for i in range(n):
-        try:
-            T[:, i] = np.linalg.solve(AA[:, :, i], BB[:, i])
-        except:
-            T[:, i] = np.Inf
+    T = _segment_intersection_(x1, y1, x2, y2, ii, jj)
 
     in_range = (T[0, :] >= 0) & (T[1, :] >= 0) & (
         T[0, :] <= 1) & (T[1, :] <= 1)
@@ -95,3 +97,62 @@ x,y=intersection(x1,y1,x2,y2)
     xy0 = xy0.T
     return xy0[:, 0], xy0[:, 1]
 
+
+def _sweep_candidates_(x, y):
+    """
+    Pairs of segments (i, j), i < j, of the curve (x,y) whose bounding boxes
+    overlap. Segments are sorted along the sweep axis (the longer extent of
+    the curve) and each is paired only with the segments that start before
+    it ends, O(n log n + k) instead of testing all n^2 pairs.
+    """
+    a = np.c_[x[:-1], y[:-1]]
+    b = np.c_[x[1:], y[1:]]
+    lo = np.fmin(a, b)
+    hi = np.fmax(a, b)
+
+    ax = int(np.nanmax(hi[:, 1]) - np.nanmin(lo[:, 1]) > np.nanmax(hi[:, 0]) - np.nanmin(lo[:, 0]))
+    order = np.argsort(lo[:, ax], kind='stable')
+    start = lo[order, ax]
+
+    # segments that start while segment order[k] is still open: k+1 ... end[k]-1
+    end = np.searchsorted(start, hi[order, ax], side='right')
+    count = np.maximum(end - np.arange(len(order)) - 1, 0)
+    k1 = np.repeat(np.arange(len(order)), count)
+    k2 = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count) + k1 + 1
+
+    ii, jj = order[k1], order[k2]
+    other = 1 - ax
+    keep = (lo[ii, other] <= hi[jj, other]) & (hi[ii, other] >= lo[jj, other])
+    ii, jj = ii[keep], jj[keep]
+    return np.minimum(ii, jj), np.maximum(ii, jj)
+
+
+def self_intersection(x, y):
+    """
+    Computes the (x,y) locations where a curve crosses itself, along with
+    the index pairs (i, j), i < j, of the crossing segments. Segments that
+    share an end point (neighbours, and the first/last segment of a closed
+    curve) are not counted as crossings. Candidate pairs are found with a 
+    sweep line, see _sweep_candidates_.
+
+usage:
+x,y,i,j=self_intersection(x,y)
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = x.shape[0]-1
+
+    ii, jj = _sweep_candidates_(x, y)
+    closed = (x[0] == x[-1]) and (y[0] == y[-1])
+    keep = jj > ii + 1
+    if closed:
+        keep &= ~((ii == 0) & (jj == n-1))
+    ii, jj = ii[keep], jj[keep]
+
+    T = _segment_intersection_(x, y, x, y, ii, jj)
+    in_range = (T[0, :] >= 0) & (T[1, :] >= 0) & (
+        T[0, :] <= 1) & (T[1, :] <= 1)
+
+    order = np.lexsort((jj[in_range], ii[in_range]))
+    return (T[2, in_range][order], T[3, in_range][order], 
+            ii[in_range][order], jj[in_range][order])
@@ -0,0 +1,40 @@
+function shapes = request_shapes(params, url)
+% shapes = request_shapes(params, url)
+%
+% Get boundaries, control segments and control points from a running shape
+% server (python shape_server.py). params is a struct or struct array of
+% shape parameters, or of saved shapes (e.g. from load_json_dict). A struct
+% array is sent as one batch.
+
+if nargin < 2
+  url = 'http://127.0.0.1:8765/shapes';
+end
+
+opts = weboptions('MediaType', 'application/json', 'ContentType', 'binary', 'Timeout', 60);
+raw = uint8(webwrite(url, params, opts));
+raw = raw(:)';
+
+if ~strcmp(char(raw(1:4)), 'SHP1')
+  error('request_shapes: unexpected response from %s', url);
+end
+n = double(typecast(raw(5:8), 'uint32'));
+pos = 9;
+
+shapes = struct([]);
+for k = 1:n
+  hdr = double(typecast(raw(pos:pos+11), 'uint32'));
+  nb = hdr(1);
+  nsegs = hdr(2);
+  pos = pos + 12;
+
+  nvals = 2*nb + 6*nsegs;
+  vals = typecast(raw(pos:pos+8*nvals-1), 'double');
+  pos = pos + 8*nvals;
+
+  shapes(k).rb = vals(1:nb);
+  shapes(k).zb = vals(nb+1:2*nb);
+  shapes(k).segs = reshape(vals(2*nb+1:2*nb+4*nsegs), 4, nsegs)';
+  shapes(k).rcp = vals(2*nb+4*nsegs+1:2*nb+5*nsegs);
+  shapes(k).zcp = vals(2*nb+5*nsegs+1:end);
+  shapes(k).valid = logical(hdr(3));
+end
@@ -1,7 +1,18 @@
 import numpy as np
 from scipy.spatial import ConvexHull
 import matplotlib.pyplot as plt
-from intersections import intersection
+from intersections import intersection, self_intersection, _segment_intersection_
+from boundary import Boundary, BoundarySpline
+
+# limiter (r,z) coordinates
+rlim = [1.26900, 1.26900, 1.26400, 1.43320, 1.38590, 1.38510, 1.29490, 1.32000, 1.44070, 1.44070, 1.50930, 1.57080, 1.57000, 1.72000, 1.72000, 1.84000, 1.84000, 1.69500, 1.65850, 1.65750, 1.64490, 1.84000, 2.03000, 2.03003, 2.08782, 2.13957, 2.18574, 2.22676, 2.26302, 2.30393, 2.33804, 2.36602, 2.38980, 2.40771, 2.42020, 2.42757, 2.43000, 2.42757, 2.42020, 2.40771, 2.38980, 2.36602, 2.33804, 2.30393, 2.26302, 2.22676, 2.18574, 2.13957, 2.08782, 2.03003, 2.03000, 1.84000, 1.64490, 1.65750, 1.65850, 1.69500, 1.84000, 1.84000, 1.72000, 1.72000, 1.57000, 1.57080, 1.50930, 1.44070, 1.44070, 1.32000, 1.29490, 1.38510, 1.38590, 1.43320, 1.26400, 1.26900, 1.26900]
+zlim = [0.00000, -0.50000, -0.50000, -1.05920, -1.11600, -1.11540, -1.22360, -1.21000, -1.20900, -1.21000, -1.20900, -1.29640, -1.29700, -1.51000, -1.57500, -1.57500, -1.38000, -1.38000, -1.21770, -1.21790, -1.16190, -1.04000, -0.87000, -0.87000, -0.81543, -0.76087, -0.70630, -0.65173, -0.59717, -0.52571, -0.45426, -0.38280, -0.30624, -0.22968, -0.15312, -0.07656, 0.00000, 0.07656, 0.15312, 0.22968, 0.30624, 0.38280, 0.45426, 0.52571, 0.59717, 0.65173, 0.70630, 0.76087, 0.81543, 0.87000, 0.87000, 1.04000, 1.16190, 1.21790, 1.21770, 1.38000, 1.38000, 1.57500, 1.57500, 1.51000, 1.29700, 1.29640, 1.20900, 1.21000, 1.20900, 1.21000, 1.22360, 1.11540, 1.11600, 1.05920, 0.50000, 0.50000, 0.00000]
+
+
+# default control segment parameters (GUI entries and shape server)
+default_seg_params = {'rc': 1.75, 'zc': 0.0, 'a': 0.15, 'b': 0.2, 'seglength': 6.0,
+                      'nsegs': 60, 'theta0': 0.0}
+
 
 def shape_create_deadstart(s):
             
@@ -21,26 +32,261 @@ def shape_create_deadstart(s):
     # create a convex hull from the circle + x-points
     xy = np.vstack((x,y)).T
     hull = ConvexHull(xy)
-    x = xy[hull.vertices,0]
-    y = xy[hull.vertices,1]
+    b = Boundary(xy[hull.vertices])
     
     # interpolate to higher point density
-    x, y = interparc(x, y, 500, mergeit=False, forceloop=False)
-    x, y = sort_ccw(x, y)
+    b = interparc(b, None, 500, mergeit=False, forceloop=False)
+    b = sort_ccw(b)
     
     # apply shaping parameters
-    [r, z] = shape_edit(x, y, s)
-    s = shape_analysis(r,z)
+    b = shape_edit(b, None, s)
 
     # interpolate and sort
-    r, z = sort_ccw(r, z)
-    r, z = interparc(r, z, 500, mergeit=False, forceloop=True)
+    b = sort_ccw(b)
+    b = interparc(b, None, 500, mergeit=False, forceloop=True)
     
-    return r, z
+    return b
+
+
+
+def add_aux_geom_params(s):
+    s['a']  = (s['Rout'] - s['Rin']) / 2.0
+    s['R0'] = (s['Rout'] + s['Rin']) / 2.0
+    s['b']  = (s['Zup'] - s['Zlo']) / 2.0
+    s['Z0'] = (s['Zup'] + s['Zlo']) / 2.0
+    s['k'] = s['b'] / s['a']
+    return s
+
+
+def get_segs(p):
+    """
+    control segments from the segment parameters p: nsegs segments spread 
+    evenly around an ellipse, followed by the manually-defined segments 
+    seg{i}_R0, seg{i}_Z0, seg{i}_Rf, seg{i}_Zf (i = 0, 1, ...)
+    """
+    # manually-defined segs
+    mansegs = []
+    i = 0
+    while f'seg{i}_R0' in p:
+        keys = [f'seg{i}_R0', f'seg{i}_Z0', f'seg{i}_Rf', f'seg{i}_Zf']
+        mansegs.append([p[key] for key in keys])
+        i += 1
+    mansegs = np.asarray(mansegs, dtype=float).reshape(-1, 4)
+
+    # parameterized segs
+    th = np.linspace(0, 2*np.pi, 200) + p['theta0']
+
+    rin = p['rc'] + p['a'] * np.cos(th)
+    zin = p['zc'] + p['b'] * np.sin(th)
+    rout = p['rc'] + p['seglength'] * p['a'] * np.cos(th)
+    zout = p['zc'] + p['seglength'] * p['b'] * np.sin(th)
+    
+    rout, zout = interparc(rout, zout, int(p['nsegs']))
+    idx = []
+    for (ro,zo) in zip(rout,zout):
+        dist2 = (rin-ro)**2 + (zin-zo)**2
+        idx.append(np.argmin(dist2))
+    
+    idx = np.asarray(idx)
+    segs = np.vstack((rin[idx], zin[idx], rout, zout)).T
+
+    # concatenate the manual and parametrized segs
+    segs = np.vstack((segs, mansegs))
+    return segs
+
+
+def _seg_curve(segs):
+    """all segments as one curve, broken with nans (segment k is curve segment 3k)"""
+    gap = np.full(segs.shape[0], np.nan)
+    x = np.c_[segs[:,0], segs[:,2], gap].ravel()
+    y = np.c_[segs[:,1], segs[:,3], gap].ravel()
+    return x, y
+
+
+def _first_hits(segs, b):
+    """
+    first crossing along the boundary b of each segment, (rcp, zcp, j) with
+    j the index of the crossed boundary segment (-1 if there is none)
+    """
+    nsegs = segs.shape[0]
+    rcp = np.empty(nsegs)*np.nan
+    zcp = np.empty(nsegs)*np.nan
+    j = np.full(nsegs, -1)
+
+    ii, jj, T = b.hits(*_seg_curve(segs))
 
+    # hits are ordered by segment, then by boundary index
+    iseg, k = np.unique(ii // 3, return_index=True)
+    rcp[iseg] = T[2, k]
+    zcp[iseg] = T[3, k]
+    j[iseg] = jj[k]
+    return rcp, zcp, j
 
 
-def sort_ccw(x,y):
+def seg_intersections(segs, rb, zb=None, tracker=None):
+    """
+    find intersection of control segments and boundary, rb may be a Boundary
+    or a BoundarySpline (zb=None). Segments that cross the boundary more than 
+    once use the first crossing along the boundary. With a SegTracker, the 
+    crossings are searched near the previous ones first (see SegTracker).
+    """
+    if isinstance(rb, BoundarySpline):
+        return rb.seg_intersections(segs)
+
+    b = rb if isinstance(rb, Boundary) else Boundary(rb, zb)
+    if tracker is not None:
+        return tracker.update(segs, b)
+    rcp, zcp, _ = _first_hits(segs, b)
+    return rcp, zcp
+
+
+class SegTracker:
+    """
+    CLASS: SegTracker
+    DESCRIPTION: control point tracking between consecutive updates, e.g. 
+    while editing a shape. Each segment is first intersected only with the 
+    boundary segments within +-window of its previous crossing. The first 
+    crossing in the window is accepted if no boundary segment before it 
+    crosses the segment, which is checked on blocks of boundary segments 
+    (Boundary.blockbox) so that the cost hardly depends on the boundary 
+    resolution. The result is the same as the full search of 
+    seg_intersections. Segments without an accepted local crossing (or 
+    without a previous one) fall back to the full search; stats counts both.
+    """
+
+    def __init__(self, window=8, blocksize=64):
+        self.window = window
+        self.blocksize = blocksize
+        self.reset()
+
+    def reset(self):
+        self.jprev = None
+        self.nb = None
+        self.stats = {'updates': 0, 'segments': 0, 'local': 0, 'fallback': 0}
+
+    @property
+    def fallback_rate(self):
+        """fraction of the segment searches that needed the full search"""
+        return self.stats['fallback'] / max(self.stats['segments'], 1)
+
+    def update(self, segs, b):
+        """control points (rcp, zcp) of segs on the Boundary b"""
+        nsegs = segs.shape[0]
+        nb = len(b.r) - 1
+        rcp = np.empty(nsegs)*np.nan
+        zcp = np.empty(nsegs)*np.nan
+        j = np.full(nsegs, -1)
+
+        # previous crossings are only valid for the same segments and boundary resolution
+        if self.jprev is None or len(self.jprev) != nsegs or self.nb != nb or 2*self.window + 1 > nb:
+            prev = np.full(nsegs, -1)
+        else:
+            prev = self.jprev
+
+        finite = np.isfinite(segs).all(axis=1)
+        tracked = np.flatnonzero((prev >= 0) & finite)
+        if len(tracked):
+            x, y = _seg_curve(segs)
+            w = np.arange(-self.window, self.window + 1)
+            ii = np.repeat(3 * tracked, len(w))
+            jj = ((prev[tracked, None] + w) % nb).ravel()
+            T = _segment_intersection_(x, y, b.r, b.z, ii, jj)
+            in_range = (T[0] >= 0) & (T[0] <= 1) & (T[1] >= 0) & (T[1] <= 1)
+
+            # first crossing along the boundary within the window
+            jwin = np.where(in_range, jj, nb).reshape(len(tracked), -1)
+            kbest = np.argmin(jwin, axis=1)
+            found = jwin[np.arange(len(tracked)), kbest] < nb
+            cols = (np.arange(len(tracked)) * len(w) + kbest)[found]
+            iseg = tracked[found]
+
+            # ... and no crossing before it outside the window
+            ok = ~self._earlier_crossings(x, y, segs[iseg], iseg, jj[cols], prev[iseg], b)
+            iseg, cols = iseg[ok], cols[ok]
+            rcp[iseg] = T[2, cols]
+            zcp[iseg] = T[3, cols]
+            j[iseg] = jj[cols]
+
+        nlocal = np.count_nonzero(j >= 0)
+        search = finite & (j < 0)
+        if search.any():
+            rcp[search], zcp[search], j[search] = _first_hits(segs[search], b)
+
+        self.jprev = j
+        self.nb = nb
+        self.stats['updates'] += 1
+        self.stats['segments'] += int(np.count_nonzero(finite))
+        self.stats['local'] += int(nlocal)
+        self.stats['fallback'] += int(np.count_nonzero(search))
+        return rcp, zcp
+
+    def _earlier_crossings(self, x, y, segs, iseg, jfirst, j0, b):
+        """
+        True for each segment (curve segment 3*iseg of (x,y)) that crosses a 
+        boundary segment with index < jfirst outside the window around j0
+        """
+        nb = len(b.r) - 1
+        size = self.blocksize
+        blocks = b.blockbox(size)
+        x0, y0, x1, y1 = segs.T
+
+        # blocks before jfirst whose box overlaps the segment's box and 
+        # straddles its line
+        C = ((np.minimum(x0, x1)[:,None] <= blocks[None,:,1]) & (np.maximum(x0, x1)[:,None] >= blocks[None,:,0]) &
+             (np.minimum(y0, y1)[:,None] <= blocks[None,:,3]) & (np.maximum(y0, y1)[:,None] >= blocks[None,:,2]) &
+             (np.arange(len(blocks))[None,:] * size < jfirst[:,None]))
+        dx, dy = (x1 - x0)[:,None], (y1 - y0)[:,None]
+        side = [dx * (blocks[None,:,k] - y0[:,None]) - dy * (blocks[None,:,i] - x0[:,None])
+                for i in (0, 1) for k in (2, 3)]
+        C &= (np.maximum.reduce(side) >= 0) & (np.minimum.reduce(side) <= 0)
+
+        # the boundary segments of those blocks
+        m, k = np.nonzero(C)
+        m = np.repeat(m, size)
+        jj = (k[:,None] * size + np.arange(size)).ravel()
+        d = np.abs(jj - j0[m])
+        keep = (jj < nb) & (jj < jfirst[m]) & (np.minimum(d, nb - d) > self.window)
+        m, jj = m[keep], jj[keep]
+
+        T = _segment_intersection_(x, y, b.r, b.z, 3 * iseg[m], jj)
+        in_range = (T[0] >= 0) & (T[0] <= 1) & (T[1] >= 0) & (T[1] <= 1)
+        earlier = np.zeros(len(segs), dtype=bool)
+        earlier[m[in_range]] = True
+        return earlier
+
+
+def check_boundary(rb, zb=None):
+    """
+    validity check of a closed boundary, rb may be a Boundary (zb=None).
+    Finds self-intersections (sweep line, see intersections.self_intersection)
+    and the segments along which the angle about the boundary center runs
+    backwards (folds). Returns a dict with the crossing points, the crossing
+    segment pairs and the backwards segments.
+    """
+    b = rb if isinstance(rb, Boundary) else Boundary(rb, zb)
+    b = b.loop()
+
+    rx, zx, i, j = self_intersection(b.r, b.z)
+
+    # angle about the center should change in the same direction for all segments
+    cr, cz = b.center
+    dth = np.diff(np.unwrap(np.arctan2(b.z - cz, b.r - cr)))
+    direction = np.sign(np.sum(dth))
+    moved = np.any(np.diff(b.rz, axis=0) != 0, axis=1)
+    k = np.nonzero((dth * direction <= 0) & moved)[0]
+
+    v = {}
+    v['valid'] = bool(rx.size == 0 and k.size == 0)
+    v['r_self_intersections'] = rx
+    v['z_self_intersections'] = zx
+    v['self_intersection_segs'] = np.c_[i, j]
+    v['nonmonotone_segs'] = k
+    return v
+
+
+def sort_ccw(x, y=None):
+    if isinstance(x, Boundary):
+        return x.sort_ccw()   # no-op if already sorted
     cx = x.mean()
     cy = y.mean()    
     angles = np.arctan2(y-cy, -x+cx)
@@ -49,28 +295,42 @@ def sort_ccw(x,y):
 
 
 def interparc(x, y, n=100, forceloop=False, mergeit=False):
-    
-    if forceloop:
-        if (x[0] != x[-1]) or (y[0] != y[-1]):
-            x = np.append(x, x[0])
-            y = np.append(y, y[0])
-                
-    lens = np.sqrt(np.diff(x)**2 + np.diff(y)**2)
-    lens = np.insert(lens, 0, 0)
-    arclens = np.cumsum(lens)
+    """
+    x may be a Boundary (y=None), the cached arc length is used and a
+    Boundary is returned
+    """
+    boundary = isinstance(x, Boundary)
+    if boundary:
+        b = x.loop() if forceloop else x
+        x, y, arclens = b.r, b.z, b.arclength
+    else:
+        if forceloop:
+            if (x[0] != x[-1]) or (y[0] != y[-1]):
+                x = np.append(x, x[0])
+                y = np.append(y, y[0])
+                    
+        lens = np.sqrt(np.diff(x)**2 + np.diff(y)**2)
+        lens = np.insert(lens, 0, 0)
+        arclens = np.cumsum(lens)
 
     # evenly distributed arc lengths
     s = np.linspace(0, arclens[-1], n+1)
 
     # linearly interpolate points according to arclength
-    x2 = np.zeros(n)
-    y2 = np.zeros(n)
-
-    for i in range(n):
-        k = np.where(arclens > s[i])[0][0] - 1
-        dk = (s[i] - arclens[k]) / (arclens[k+1] - arclens[k]) # remainder
-        x2[i] = x[k] + dk * (x[k+1] - x[k])
-        y2[i] = y[k] + dk * (y[k+1] - y[k])
+    k = np.searchsorted(arclens, s[:-1], side='right') - 1
+    dk = (s[:-1] - arclens[k]) / (arclens[k+1] - arclens[k]) # remainder
+
+    if boundary and not mergeit:
+        # write straight into the (n,2) array of the new Boundary, 
+        # resampling keeps the ordering of the points
+        rz = np.empty((n+1 if forceloop else n, 2))
+        rz[:n] = b.rz[k] + dk[:,None] * (b.rz[k+1] - b.rz[k])
+        if forceloop:
+            rz[n] = rz[0]
+        return Boundary(rz, ccw=b.ccw)
+
+    x2 = x[k] + dk * (x[k+1] - x[k])
+    y2 = y[k] + dk * (y[k+1] - y[k])
         
     # merge original set of points with new set
     if mergeit:
@@ -91,29 +351,34 @@ def interparc(x, y, n=100, forceloop=False, mergeit=False):
             x2 = np.append(x2, x2[0])
             y2 = np.append(y2, y2[0])
 
+    if boundary:
+        return Boundary(x2, y2, ccw=b.ccw)
     return x2, y2
 
-def shape_analysis(r,z):
-   
-    r = np.asarray(r)
-    z = np.asarray(z)
-    [r,z] = sort_ccw(r,z)
+def shape_analysis(r, z=None):
+    """
+    r may be a Boundary (z=None), its cached ordering, extremal points and
+    segment bounding boxes are reused
+    """
+    b = r if isinstance(r, Boundary) else Boundary(r, z)
+    b = sort_ccw(b)
+    r, z = b
 
     # find inner, outer, upper, lower points
     s = {}
-    ii = np.argmin(r)
+    ii = b.extrema['i']
     s['ri'] = r[ii]
     s['zi'] = z[ii]
 
-    io = np.argmax(r)
+    io = b.extrema['o']
     s['ro'] = r[io]
     s['zo'] = z[io]
 
-    iu = np.argmax(z)
+    iu = b.extrema['u']
     s['ru'] = r[iu]
     s['zu'] = z[iu]
 
-    il = np.argmin(z)
+    il = b.extrema['l']
     s['rl'] = r[il]
     s['zl'] = z[il]
 
@@ -130,18 +395,20 @@ def shape_analysis(r,z):
 
     # order matters for the squareness inputs 
     # (outer/inner point should precede upper/lower point) 
-    s['squo'] = squareness(s['ro'], s['zo'], s['ru'], s['zu'], r, z)
-    s['sqlo'] = squareness(s['ro'], s['zo'], s['rl'], s['zl'], r, z)
-    s['squi'] = squareness(s['ri'], s['zi'], s['ru'], s['zu'], r, z)
-    s['sqli'] = squareness(s['ri'], s['zi'], s['rl'], s['zl'], r, z)
+    s['squo'] = squareness(s['ro'], s['zo'], s['ru'], s['zu'], b)
+    s['sqlo'] = squareness(s['ro'], s['zo'], s['rl'], s['zl'], b)
+    s['squi'] = squareness(s['ri'], s['zi'], s['ru'], s['zu'], b)
+    s['sqli'] = squareness(s['ri'], s['zi'], s['rl'], s['zl'], b)
 
     return s
 
 
-def squareness(r1, z1, r2, z2, r, z):
+def squareness(r1, z1, r2, z2, r, z=None):
     """
     squareness definition from: 
     https://iopscience.iop.org/article/10.1088/0741-3335/55/9/095009/meta
+
+    r may be a Boundary (z=None)
     """
     A = r1 - r2
     B = z2 - z1
@@ -154,7 +421,10 @@ def squareness(r1, z1, r2, z2, r, z):
     zseg = np.array([z1,z2])
 
     [rc, zc] = intersection(rseg, zseg, rellipse, zellipse)
-    [rd, zd] = intersection(rseg, zseg, r, z)
+    if isinstance(r, Boundary):
+        [rd, zd] = r.intersection(rseg, zseg)
+    else:
+        [rd, zd] = intersection(rseg, zseg, r, z)
 
     LOD = np.linalg.norm(np.array([rd - r2, zd - z1]))
     LOC = np.linalg.norm(np.array([rc - r2, zc - z1]))
@@ -174,12 +444,14 @@ def shape_edit(r,z,s):
     The parameters in s that will edit the shape are: ['R0','Z0','a','k','triu',
     'tril','squo','squi','sqlo','sqli','xplo','xpup'}.  All other parameters are
     ignored during shape_edit. 
-    """
-    r = np.asarray(r)
-    z = np.asarray(z)
 
-    [r,z] = sort_ccw(r,z)
-    s0 = shape_analysis(r,z)
+    r may be a Boundary (z=None), in which case a Boundary is returned.
+    """
+    boundary = isinstance(r, Boundary)
+    b = r if boundary else Boundary(r, z)
+    b = sort_ccw(b)
+    r, z = b
+    s0 = shape_analysis(b)
     
     # shape edits from (R0, Z0)
     r = r + s['R0'] - s0['R0']
@@ -195,7 +467,8 @@ def shape_edit(r,z,s):
     z = s['Z0'] + (z-s['Z0']) * bminor / b0
   
     # shape edits from (triu, tril)
-    s0 = shape_analysis(r,z)
+    # (shifts and axis-aligned scaling keep the ccw ordering)
+    s0 = shape_analysis(Boundary(r, z, ccw=True))
     
     ru = s['R0'] - s['a'] * s['triu']
     dru = ru - s0['ru']         # how much ru needs to move to match triu
@@ -222,13 +495,17 @@ def shape_edit(r,z,s):
     r = np.concatenate((r1,r2,r3,r4))
     z = np.concatenate((z1,z2,z3,z4))
     
-    [r,z] = sort_ccw(r,z)
+    b = sort_ccw(Boundary(r, z))
     
     # make it a loop
-    r = np.append(r, r[0])
-    z = np.append(z, z[0])
-
-    return r, z
+    rz = np.empty((len(b)+1, 2))
+    rz[:-1] = b.rz
+    rz[-1] = b.rz[0]
+    b = Boundary(rz)
+
+    if boundary:
+        return b
+    return b.r, b.z
 
 
 def edit_squareness(r1,z1,r2,z2,sqinput,sqtarget,r,z):
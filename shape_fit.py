@@ -0,0 +1,139 @@
+import numpy as np
+import json
+from functools import partial
+from scipy.optimize import least_squares
+from shape_callbacks import shape_create_deadstart, shape_analysis, add_aux_geom_params, interparc
+from boundary import BoundarySpline
+
+"""
+Inverse fit: find the shape parameters whose boundary best matches a target
+boundary given as a set of (r,z) points.
+"""
+
+# shape parameters that are solved for, and their bounds
+fit_keys = ['Zup', 'Zlo', 'Rout', 'Rin', 'triu', 'tril', 'squo', 'squi', 'sqlo', 'sqli', 'c_xplo', 'c_xpup']
+fit_bounds = {'triu': (-0.99, 0.99), 'tril': (-0.99, 0.99),
+              'squo': (-0.9, 0.9), 'squi': (-0.9, 0.9), 'sqlo': (-0.9, 0.9), 'sqli': (-0.9, 0.9),
+              'c_xplo': (0.0, 1.0), 'c_xpup': (0.0, 1.0)}
+
+
+def load_boundary(fn):
+    """
+    Read a target boundary from a saved shape (.json with 'rb','zb' or 
+    'boundary_spline') or from a text file with two columns of r, z values.
+    """
+    if fn.endswith('.json'):
+        with open(fn) as f:
+            d = json.load(f)
+        d = d.get('shape_params', d)
+        if 'rb' not in d:
+            return tuple(BoundarySpline.from_dict(d['boundary_spline']).resample(500))
+        return np.asarray(d['rb'], dtype=float), np.asarray(d['zb'], dtype=float)
+
+    with open(fn) as f:
+        rz = np.loadtxt(line.replace(',', ' ') for line in f)
+    return rz[:,0], rz[:,1]
+
+
+def initial_guess(r, z):
+    """
+    Shape parameters estimated directly from the target boundary.
+    """
+    s0 = shape_analysis(r, z)
+    s = {'Zup': s0['zu'], 'Zlo': s0['zl'], 'Rout': s0['ro'], 'Rin': s0['ri'],
+         'c_xplo': 0.07, 'c_xpup': 0.07}
+    for key in ['triu', 'tril', 'squo', 'squi', 'sqlo', 'sqli']:
+        lo, hi = fit_bounds[key]
+        s[key] = np.clip(s0[key], lo, hi)
+    return s
+
+
+def boundary_distance(rp, zp, rb, zb):
+    """
+    Distance from each point (rp,zp) to the closest point on the polyline (rb,zb).
+    """
+    ax, ay = rb[:-1], zb[:-1]
+    dx, dy = np.diff(rb), np.diff(zb)
+    L2 = dx**2 + dy**2
+    L2[L2 == 0] = 1
+
+    px = rp[:,None] - ax[None,:]
+    py = zp[:,None] - ay[None,:]
+    t = np.clip((px*dx + py*dy) / L2, 0, 1)
+    d2 = (px - t*dx)**2 + (py - t*dy)**2
+    return np.sqrt(d2.min(axis=1))
+
+
+def fit_residuals(rb, zb, rt, zt):
+    """
+    Symmetric boundary distance: target points to the shape boundary and shape
+    boundary points to the target.
+    """
+    return np.concatenate((boundary_distance(rt, zt, rb, zb),
+                           boundary_distance(rb[:-1:2], zb[:-1:2], rt, zt)))
+
+
+def shape_residuals(s, rt, zt):
+    """
+    fit residuals of the shape with parameters s (forward model + fit_residuals)
+    """
+    rb, zb = shape_create_deadstart(add_aux_geom_params(dict(s)))
+    return fit_residuals(rb, zb, rt, zt)
+
+
+def fit_shape(rt, zt, s0=None, npts=200, keys=fit_keys, diff_step=1e-4, verbose=0, pool=None):
+    """
+    Solve for the shape parameters that minimize the distance between the shape
+    boundary and the target boundary (rt,zt).
+
+    s0 is an optional dict with the initial parameters, parameters in s0 that
+    are not listed in keys are held fixed. pool is an optional executor 
+    (concurrent.futures) that evaluates the perturbed shapes of the jacobian
+    in parallel. Returns the fitted parameter dict and the scipy.optimize result.
+    """
+    rt = np.asarray(rt, dtype=float)
+    zt = np.asarray(zt, dtype=float)
+    i = ~(np.isnan(rt) | np.isnan(zt))
+    rt, zt = interparc(rt[i], zt[i], npts, forceloop=True)
+    rt, zt = rt[:-1], zt[:-1]
+
+    s = initial_guess(rt, zt)
+    if s0 is not None:
+        s.update({key: s0[key] for key in keys if np.isfinite(s0.get(key, np.nan))})
+
+    lo = np.array([fit_bounds.get(key, (-np.inf, np.inf))[0] for key in keys])
+    hi = np.array([fit_bounds.get(key, (-np.inf, np.inf))[1] for key in keys])
+    x0 = np.clip([s[key] for key in keys], lo + 1e-6, hi - 1e-6)
+
+    def params(x):
+        p = dict(s)
+        p.update(zip(keys, x))
+        return p
+
+    # cache the most recent evaluation, so that the jacobian can reuse it
+    cache = {}
+
+    def fun(x):
+        cache['x'] = x.copy()
+        cache['f'] = shape_residuals(params(x), rt, zt)
+        return cache['f']
+
+    def jac(x):
+        f0 = cache['f'] if np.array_equal(cache.get('x'), x) else fun(x)
+
+        # forward differences, stepping away from the bounds, one perturbed 
+        # shape per parameter (spread over the pool if there is one)
+        h = diff_step * np.where(x + diff_step > hi, -1, 1)
+        X = x + np.diag(h)
+        P = [params(xi) for xi in X]
+        if pool is None:
+            F = [shape_residuals(p, rt, zt) for p in P]
+        else:
+            F = list(pool.map(partial(shape_residuals, rt=rt, zt=zt), P))
+        return (np.array(F) - f0).T / h
+
+    res = least_squares(fun, x0, jac=jac, bounds=(lo, hi), x_scale='jac',
+                        xtol=1e-6, ftol=1e-6, max_nfev=50, verbose=verbose)
+
+    sfit = {key: float(val) for key, val in zip(keys, res.x)}
+    return sfit, res
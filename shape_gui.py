@@ -4,8 +4,15 @@ from functools import partial
 from matplotlib.figure import Figure 
 from matplotlib.backends.backend_tkagg import (FigureCanvasTkAgg, NavigationToolbar2Tk) 
 import matplotlib.pyplot as plt
-from shape_callbacks import shape_create_deadstart, interparc
-from intersections import intersection
+from shape_callbacks import shape_create_deadstart, add_aux_geom_params, seg_intersections, check_boundary, get_segs, rlim, zlim, SegTracker, default_seg_params
+from boundary import Boundary, BoundarySpline
+from shape_render import setup_axes, invalid_regions
+from shape_fit import fit_shape, load_boundary
+from shape_scan import scan_grid, scan_point, scan_metrics
+from shape_history import ShapeHistory
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 import numpy as np
 import json
 
@@ -26,12 +33,13 @@ class App:
         self.define_root_window()                              
                              
         # create notebook with tabs
-        notebook = ttk.Notebook(self.root)   
-        tab1 = ttk.Frame(notebook)        
-        tab2 = ttk.Frame(notebook)
-        notebook.add(tab1, text='tab1')
-        notebook.add(tab2, text='tab2')
-        notebook.pack(expand=1, fill='both')
+        self.notebook = ttk.Notebook(self.root)   
+        tab1 = ttk.Frame(self.notebook)        
+        tab2 = ttk.Frame(self.notebook)
+        self.notebook.add(tab1, text='tab1')
+        self.notebook.add(tab2, text='tab2')
+        self.notebook.pack(expand=1, fill='both')
+        self.tab1 = tab1
 
         # fileio panel
         self.add_fileio_panel(tab1)
@@ -49,9 +57,21 @@ class App:
         plot_frame.pack(side='left', anchor='nw', padx=10)
         self.add_plot_axes(plot_frame)    
 
+        # parameter scan explorer
+        self.add_scan_panel(tab2)
+
+        # undo/redo history of the parameters, with the computed shapes cached
+        self.seg_tracker = SegTracker()
+        self.history = ShapeHistory(tracker=self.seg_tracker)
+        self.root.bind('<Control-z>', self.undo)
+        self.root.bind('<Control-y>', self.redo)
+        self.root.bind('<Control-Z>', self.redo)
+
         # plot shape
         self.update_plots()
 
+        self.root.protocol('WM_DELETE_WINDOW', self.close)
+
 
     # panel to hold fileio buttons
     def add_fileio_panel(self, parent):
@@ -65,6 +85,15 @@ class App:
         B = tk.Button(panel, text='Load Shape', command=self.load_shape)
         B.pack(side='left', anchor='sw', padx=10, pady=10)
 
+        B = tk.Button(panel, text='Fit Boundary', command=self.fit_boundary)
+        B.pack(side='left', anchor='sw', padx=10, pady=10)
+
+        B = tk.Button(panel, text='Undo', command=self.undo)
+        B.pack(side='left', anchor='sw', padx=10, pady=10)
+
+        B = tk.Button(panel, text='Redo', command=self.redo)
+        B.pack(side='left', anchor='sw', padx=10, pady=10)
+
 
     def add_plot_opts_panel(self, parent):
 
@@ -84,6 +113,11 @@ class App:
         B = tk.Checkbutton(panel, text='label x-points', variable = self.label_xpts, command=self.update_plots)
         B.pack(side='top', anchor='nw', padx=10, pady=0)
 
+        # how often control point tracking needed the full boundary search
+        self.tracking_status = tk.StringVar(value='')
+        label = tk.Label(panel, textvariable=self.tracking_status)
+        label.pack(side='top', anchor='nw', padx=10, pady=0)
+
 
     def add_segs_panel(self, parent):
          
@@ -96,13 +130,8 @@ class App:
         seg_key_labels = ['# segs', 'seg_length', 'theta0', 'ellipse_r0', 'ellipse_z0', 'ellipse_a', 'ellipse_b']
 
         self.seg_params = {}
-        self.seg_params['rc']        = tk.StringVar(value='1.75')
-        self.seg_params['zc']        = tk.StringVar(value='0')
-        self.seg_params['a']         = tk.StringVar(value='0.15')
-        self.seg_params['b']         = tk.StringVar(value='0.2')
-        self.seg_params['seglength'] = tk.StringVar(value='6')
-        self.seg_params['nsegs']     = tk.StringVar(value='60')
-        self.seg_params['theta0']    = tk.StringVar(value='0')
+        for key in seg_keys:
+            self.seg_params[key] = tk.StringVar(value=f'{default_seg_params[key]:g}')
         
         # assign widgets for each segment parameter
         for i, (key, key_label) in enumerate(zip(seg_keys, seg_key_labels)):
@@ -142,46 +171,17 @@ class App:
                 d[key] = np.nan       # otherwise, nan
         return d
     
-    def get_segs(self):
-
-        # manually-defined segs
-        n = self.seg_params['n_manual_segs']
-        mansegs = np.empty((n,4))
-        for i in range(n):
-            keys = [f'seg{i}_R0', f'seg{i}_Z0', f'seg{i}_Rf', f'seg{i}_Zf']
-            for j, key in enumerate(keys):
-                dum = self.seg_params[key].get()
-                try:
-                    mansegs[i,j] = float(dum)   # convert to numeric if possible
-                except:
-                    mansegs[i,j] = np.nan       # otherwise, nan
-
+    def tkdict2str(self, tkdict):
+        # entry texts of the Tk variables, e.g. for the history snapshots
+        return {key: val.get() for key, val in tkdict.items() if isinstance(val, tk.Variable)}
 
-        # parameterized segs
-        p = self.tkdict2dict(self.seg_params)
-        th = np.linspace(0, 2*np.pi, 200) + p['theta0']
-
-        rin = p['rc'] + p['a'] * np.cos(th)
-        zin = p['zc'] + p['b'] * np.sin(th)
-        rout = p['rc'] + p['seglength'] * p['a'] * np.cos(th)
-        zout = p['zc'] + p['seglength'] * p['b'] * np.sin(th)
-        
-        rout, zout = interparc(rout, zout, int(p['nsegs']))
-        idx = []
-        for (ro,zo) in zip(rout,zout):
-            dist2 = (rin-ro)**2 + (zin-zo)**2
-            idx.append(np.argmin(dist2))
-        
-        idx = np.asarray(idx)
-        segs = np.vstack((rin[idx], zin[idx], rout, zout)).T
-
-        # concatenate the manual and parametrized segs
-        segs = np.vstack((segs, mansegs))
-        return segs                       
+    def get_segs(self):
+        p = self.tkdict2dict(self.seg_params)   # manual segs that are not numeric become nan
+        return get_segs(p)
 
     def plot_limiter(self, ax):
-        self.rl = [1.26900, 1.26900, 1.26400, 1.43320, 1.38590, 1.38510, 1.29490, 1.32000, 1.44070, 1.44070, 1.50930, 1.57080, 1.57000, 1.72000, 1.72000, 1.84000, 1.84000, 1.69500, 1.65850, 1.65750, 1.64490, 1.84000, 2.03000, 2.03003, 2.08782, 2.13957, 2.18574, 2.22676, 2.26302, 2.30393, 2.33804, 2.36602, 2.38980, 2.40771, 2.42020, 2.42757, 2.43000, 2.42757, 2.42020, 2.40771, 2.38980, 2.36602, 2.33804, 2.30393, 2.26302, 2.22676, 2.18574, 2.13957, 2.08782, 2.03003, 2.03000, 1.84000, 1.64490, 1.65750, 1.65850, 1.69500, 1.84000, 1.84000, 1.72000, 1.72000, 1.57000, 1.57080, 1.50930, 1.44070, 1.44070, 1.32000, 1.29490, 1.38510, 1.38590, 1.43320, 1.26400, 1.26900, 1.26900]
-        self.zl = [0.00000, -0.50000, -0.50000, -1.05920, -1.11600, -1.11540, -1.22360, -1.21000, -1.20900, -1.21000, -1.20900, -1.29640, -1.29700, -1.51000, -1.57500, -1.57500, -1.38000, -1.38000, -1.21770, -1.21790, -1.16190, -1.04000, -0.87000, -0.87000, -0.81543, -0.76087, -0.70630, -0.65173, -0.59717, -0.52571, -0.45426, -0.38280, -0.30624, -0.22968, -0.15312, -0.07656, 0.00000, 0.07656, 0.15312, 0.22968, 0.30624, 0.38280, 0.45426, 0.52571, 0.59717, 0.65173, 0.70630, 0.76087, 0.81543, 0.87000, 0.87000, 1.04000, 1.16190, 1.21790, 1.21770, 1.38000, 1.38000, 1.57500, 1.57500, 1.51000, 1.29700, 1.29640, 1.20900, 1.21000, 1.20900, 1.21000, 1.22360, 1.11540, 1.11600, 1.05920, 0.50000, 0.50000, 0.00000]
+        self.rl = rlim
+        self.zl = zlim
         ax.plot(self.rl, self.zl, linewidth=1.5, color='black')     
 
     def add_plot_axes(self, parent): 
@@ -191,29 +191,7 @@ class App:
         """       
 
         self.fig = Figure(figsize = (6,6), dpi = 100) 
-        self.axs = [None]*3
-        self.axs[0] = self.fig.add_subplot(2,2,(1,3)) 
-        self.axs[1] = self.fig.add_subplot(2,2,2) 
-        self.axs[2] = self.fig.add_subplot(2,2,4) 
-
-        for i in range(3):            
-            self.axs[i].grid(visible=True)            
-            if i == 0:
-                self.axs[i].set_ylabel('Z [m]', fontsize=12)
-            if i in (0,2):
-                self.axs[i].set_xlabel('R [m]', fontsize=12)
-            if i == 1:
-                self.axs[i].xaxis.set_ticklabels([])
-
-        self.axs[0].set_xlim((1.2, 2.5))
-        self.axs[0].set_ylim((-1.7, 1.7))
-        self.axs[1].set_xlim((1.3, 1.85))
-        self.axs[1].set_ylim((1.1, 1.6))
-        self.axs[2].set_xlim((1.3, 1.85))
-        self.axs[2].set_ylim((-1.6, -1.1))
-
-        self.fig.tight_layout()
-        
+        self.axs = setup_axes(self.fig)
         
         self.canvas = FigureCanvasTkAgg(self.fig, master=parent)   
         self.canvas.draw() 
@@ -243,6 +221,7 @@ class App:
                            'Squareness up/out', 'Squareness up/in', 'Squareness lo/out', 'Squareness lo/in', 'Xpt_coeff lower', 
                            'Xpt_coeff upper']
         
+        self.shape_keys = shape_keys
         self.shape_params['Zup']   = tk.StringVar(value='1.14')
         self.shape_params['Zlo']   = tk.StringVar(value='-1.14')
         self.shape_params['Rout'] = tk.StringVar(value='2.4')
@@ -334,23 +313,239 @@ class App:
             entry.bind('<Return>', self.update_plots)                                    
             entry.grid(row=i, column=4)
 
-    def seg_intersections(self, segs, rb, zb):
+    def add_scan_panel(self, parent):
+        """
+        METHOD: add_scan_panel
+        DESCRIPTION: two-parameter scan of the shape, evaluated in a worker 
+        pool and shown as heatmaps of derived metrics
+        """
+        panel = tk.LabelFrame(parent, text='Parameter scan', highlightbackground="gray", highlightthickness=2)
+        panel.pack(side='left', anchor='nw', padx=10, pady=10)
+
+        # scan parameters and ranges
+        self.scan_params = {}
+        defaults = [('triu', '0.2', '0.8', '15'), ('squo', '-0.4', '0.2', '15')]
+        row = 0
+        for k, (key, vmin, vmax, n) in enumerate(defaults):
+            prefix = f'p{k+1}_'
+            self.scan_params[prefix + 'key'] = tk.StringVar(value=key)
+            self.scan_params[prefix + 'min'] = tk.StringVar(value=vmin)
+            self.scan_params[prefix + 'max'] = tk.StringVar(value=vmax)
+            self.scan_params[prefix + 'n'] = tk.StringVar(value=n)
+
+            label = tk.Label(panel, text=f'Parameter {k+1}')
+            label.grid(row=row, column=1)
+            box = ttk.Combobox(panel, width=8, state='readonly', values=self.shape_keys, 
+                               textvariable=self.scan_params[prefix + 'key'])
+            box.grid(row=row, column=3)
+            row += 1
+
+            for (name, text) in [('min', 'min'), ('max', 'max'), ('n', '# pts')]:
+                label = tk.Label(panel, text=text)
+                label.grid(row=row, column=1)
+                entry = tk.Entry(panel, bd=5, width=10, textvariable=self.scan_params[prefix + name])
+                entry.grid(row=row, column=3)
+                row += 1
+
+        B = tk.Button(panel, text='Run Scan', command=self.run_scan)
+        B.grid(row=row, column=1, padx=10, pady=10)
+        B = tk.Button(panel, text='Stop Scan', command=self.stop_scan)
+        B.grid(row=row, column=3, padx=10, pady=10)
+
+        self.scan_status = tk.StringVar(value='')
+        label = tk.Label(panel, textvariable=self.scan_status)
+        label.grid(row=row+1, column=1, columnspan=3)
+
+        # heatmaps of the scan metrics
+        plot_frame = tk.Frame(parent)
+        plot_frame.pack(side='left', anchor='nw', padx=10)
+
+        self.scan_fig = Figure(figsize = (8,7), dpi = 100)
+        self.scan_axs = []
+        self.scan_images = []
+        self.scan_markers = []
+        for i, metric in enumerate(scan_metrics):
+            ax = self.scan_fig.add_subplot(2,2,i+1)
+            ax.set_title(metric, fontsize=10)
+            im = ax.imshow(np.ma.masked_all((1,1)), origin='lower', aspect='auto', interpolation='nearest')
+            self.scan_fig.colorbar(im, ax=ax)
+            marker, = ax.plot([], [], marker='s', mfc='none', mec='red', ms=10)
+            self.scan_axs.append(ax)
+            self.scan_images.append(im)
+            self.scan_markers.append(marker)
+        self.scan_fig.tight_layout()
+
+        self.scan_canvas = FigureCanvasTkAgg(self.scan_fig, master=plot_frame)
+        self.scan_canvas.draw()
+        self.scan_canvas.get_tk_widget().pack()
+        self.scan_canvas.mpl_connect('button_press_event', self.select_scan_cell)
+
+        self.scan = None
+        self.scan_pool = None
+
+    def run_scan(self, event=None):
+        """
+        METHOD: run_scan
+        DESCRIPTION: submit every point of the scan grid to the worker pool
+        """
+        self.stop_scan()
+
+        keys, vals = [], []
+        for prefix in ['p1_', 'p2_']:
+            keys.append(self.scan_params[prefix + 'key'].get())
+            vmin = float(self.scan_params[prefix + 'min'].get())
+            vmax = float(self.scan_params[prefix + 'max'].get())
+            n = max(int(float(self.scan_params[prefix + 'n'].get())), 1)
+            vals.append(np.linspace(vmin, vmax, n))
+
+        # the current shape is the reference for the scan
+        s = self.tkdict2dict(self.shape_params)
+        s = self.add_aux_geom_params(s)
+        segs = self.get_segs()
+        b = shape_create_deadstart(s)
+        rcp0, zcp0 = self.seg_intersections(segs, b)
+
+        pool = self.worker_pool()
+        scan = {'keys': keys, 'vals': vals, 'results': {}, 'futures': {}, 'nfailed': 0,
+                'ntotal': len(vals[0]) * len(vals[1])}
+        scan['metrics'] = {m: np.full((len(vals[0]), len(vals[1])), np.nan) for m in scan_metrics}
+        for (i, j, p) in scan_grid(keys[0], vals[0], keys[1], vals[1]):
+            f = pool.submit(scan_point, i, j, dict(s, **p), segs, rcp0, zcp0)
+            scan['futures'][f] = (i, j)
+        self.scan = scan
+
+        # reset the heatmaps to the new grid
+        extent = []
+        for v in vals:
+            dv = (v[-1] - v[0]) / (len(v) - 1) if len(v) > 1 else 1.0
+            extent += [v[0] - dv/2, v[-1] + dv/2]
+
+        for ax, im, marker in zip(self.scan_axs, self.scan_images, self.scan_markers):
+            im.set_extent(extent)
+            ax.set_xlim(extent[:2])
+            ax.set_ylim(extent[2:])
+            ax.set_xlabel(keys[0])
+            ax.set_ylabel(keys[1])
+            marker.set_data([], [])
+
+        self.root.after(100, self.poll_scan, scan)
+
+    def poll_scan(self, scan):
+        """
+        METHOD: poll_scan
+        DESCRIPTION: collect finished scan points and fill in the heatmaps
+        """
+        if scan is not self.scan:
+            return
+
+        pending = {}
+        broken = False
+        for f, (i, j) in scan['futures'].items():
+            if not f.done():
+                pending[f] = (i, j)
+            elif not f.cancelled():
+                try:
+                    _, _, m, result = f.result()
+                except Exception as e:
+                    # e.g. a worker died (BrokenProcessPool), the point stays empty
+                    scan['nfailed'] += 1
+                    broken |= isinstance(e, BrokenProcessPool)
+                    continue
+                for key in scan_metrics:
+                    scan['metrics'][key][i,j] = m[key]
+                scan['results'][(i,j)] = result
+        scan['futures'] = pending
+
+        # the remaining points can't finish, the next scan or fit starts a new pool
+        if broken:
+            scan['nfailed'] += len(pending)
+            scan['futures'] = pending = {}
+            if self.scan_pool is not None:
+                self.scan_pool.shutdown(wait=False, cancel_futures=True)
+                self.scan_pool = None
+
+        for key, im in zip(scan_metrics, self.scan_images):
+            im.set_data(np.ma.masked_invalid(scan['metrics'][key].T))
+            im.autoscale()
+        self.scan_canvas.draw_idle()
+
+        status = f"{len(scan['results'])} / {scan['ntotal']} shapes"
+        if scan['nfailed']:
+            status += f", {scan['nfailed']} failed"
+        self.scan_status.set(status)
+        if pending:
+            self.root.after(200, self.poll_scan, scan)
+
+    def worker_pool(self):
+        """
+        METHOD: worker_pool
+        DESCRIPTION: process pool for scans and fits, started on first use
+        """
+        # spawned (not forked) workers, so they don't inherit the Tk state
+        if self.scan_pool is None:
+            self.scan_pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+        return self.scan_pool
+
+    def stop_scan(self, event=None):
+        """
+        METHOD: stop_scan
+        DESCRIPTION: cancel the scan points that have not started yet
+        """
+        if self.scan is not None:
+            for f in self.scan['futures']:
+                f.cancel()
+
+    def select_scan_cell(self, event):
+        """
+        METHOD: select_scan_cell
+        DESCRIPTION: load the shape of the clicked scan cell from the cached 
+        scan results
+        """
+        if self.scan is None or event.inaxes not in self.scan_axs:
+            return
+
+        vals = self.scan['vals']
+        i = np.argmin(np.abs(vals[0] - event.xdata))
+        j = np.argmin(np.abs(vals[1] - event.ydata))
+        result = self.scan['results'].get((i,j))
+        if result is None or result[1] is None:
+            print('No shape available for this scan point.')
+            return
+
+        for marker in self.scan_markers:
+            marker.set_data([vals[0][i]], [vals[1][j]])
+        self.scan_canvas.draw_idle()
+
+        # the entries get the exact parameters of the scan point, so that its
+        # boundary can go into the history cache; the control points are for
+        # the current segment entries
+        s, rb, zb = result[:3]
+        for key in self.shape_params:
+            self.shape_params[key].set(str(float(s[key])))
+        self.history.record(self.tkdict2str(self.shape_params), self.tkdict2str(self.seg_params))
+        self.history.add_boundary(self.history.current, s, Boundary(rb, zb))
+
+        s, b, segs, rcp, zcp, validity = self.history.results()
+        self.plot_shape(s, b.r, b.z, segs, rcp, zcp, validity)
+        self.notebook.select(self.tab1)
+
+    def close(self):
+        """
+        METHOD: close
+        DESCRIPTION: drop the queued scan points and stop the worker pool 
+        without waiting for it, then close the window
+        """
+        if self.scan_pool is not None:
+            self.scan_pool.shutdown(wait=False, cancel_futures=True)
+            self.scan_pool = None
+        self.root.destroy()
+
+    def seg_intersections(self, segs, rb, zb=None):
         """
         METHOD: seg_intersections
         DESCRIPTION: find intersection of control segments and boundary                
         """  
-        nsegs = segs.shape[0]
-        rcp = np.empty(nsegs)*np.nan
-        zcp = np.empty(nsegs)*np.nan
-        for i in range(segs.shape[0]):            
-            rseg = segs[i,[0,2]]
-            zseg = segs[i,[1,3]]
-            r_, z_ = intersection(rseg, zseg, rb, zb)
-            if r_.size != 0:
-                rcp[i] = r_[0]
-                zcp[i] = z_[0]
-
-        return rcp, zcp                
+        return seg_intersections(segs, rb, zb)
 
     def set_entry_text(self, entry, text):
         """
@@ -379,26 +574,62 @@ class App:
 
     # def add_aux_geom_params(self,s):
     def add_aux_geom_params(self, s):
-        s['a']  = (s['Rout'] - s['Rin']) / 2.0
-        s['R0'] = (s['Rout'] + s['Rin']) / 2.0
-        s['b']  = (s['Zup'] - s['Zlo']) / 2.0
-        s['Z0'] = (s['Zup'] + s['Zlo']) / 2.0
-        s['k'] = s['b'] / s['a']
-        return s
+        return add_aux_geom_params(s)
 
     def update_plots(self, event=None):
         """
         METHOD: update_plots
         DESCRIPTION:                
         """        
-        # convert values form Tk-formatted shape_params to a normal python dict
-        s = self.tkdict2dict(self.shape_params)
-        s = self.add_aux_geom_params(s)
-        
-        # create boundary shape from params
-        rb, zb = shape_create_deadstart(s)
-        segs = self.get_segs()
-        rcp, zcp = self.seg_intersections(segs, rb, zb)
+        # record the current entries in the history, unchanged entries are not recorded again
+        self.history.record(self.tkdict2str(self.shape_params), self.tkdict2str(self.seg_params))
+
+        # create boundary shape, control segments and points from params (or from the history cache)
+        s, b, segs, rcp, zcp, validity = self.history.results()
+
+        stats = self.seg_tracker.stats
+        self.tracking_status.set(f"control pt full searches: {stats['fallback']}/{stats['segments']} "
+                                 f"({100*self.seg_tracker.fallback_rate:.0f}%)")
+
+        self.plot_shape(s, b.r, b.z, segs, rcp, zcp, validity)
+
+    def undo(self, event=None):
+        """
+        METHOD: undo
+        DESCRIPTION: restore the previous parameters from the history
+        """
+        self.restore_state(self.history.undo())
+
+    def redo(self, event=None):
+        """
+        METHOD: redo
+        DESCRIPTION: restore the next parameters from the history
+        """
+        self.restore_state(self.history.redo())
+
+    def restore_state(self, state):
+        """
+        METHOD: restore_state
+        DESCRIPTION: set the entries to a history state and plot its cached shape
+        """
+        if state is None:
+            return
+        for key, val in state['shape_params'].items():
+            self.shape_params[key].set(val)
+        for key, val in state['seg_params'].items():
+            self.seg_params[key].set(val)
+
+        s, b, segs, rcp, zcp, validity = self.history.results(state)
+        self.plot_shape(s, b.r, b.z, segs, rcp, zcp, validity)
+
+    def plot_shape(self, s, rb, zb, segs, rcp, zcp, validity=None):
+        """
+        METHOD: plot_shape
+        DESCRIPTION: plot an already computed boundary and control points
+        """
+        if validity is None:
+            validity = check_boundary(rb, zb)
+        rinv, zinv = invalid_regions(rb, zb, validity)
 
         # plot boundary shape
         for i in range(len(self.axs)):
@@ -411,6 +642,11 @@ class App:
             # plot limiter and new shape
             self.plot_limiter(ax)
             ax.plot(rb, zb, linewidth=1, color='red')   
+
+            # highlight invalid (self-intersecting or folded) boundary regions
+            ax.plot(rinv, zinv, linewidth=3, color='orange', alpha=0.8)
+            ax.scatter(validity['r_self_intersections'], validity['z_self_intersections'], 
+                       s=40, c='orange', marker='o')
             
             # plot manually-defined (r,z) points
             for k in range(8):
@@ -449,6 +685,14 @@ class App:
                     zkey = 'zx' + txt
                     ax.annotate(txt, (s[rkey], s[zkey]))           
 
+        if validity['valid']:
+            self.axs[0].set_title('')
+        else:
+            nx = len(validity['r_self_intersections'])
+            nf = len(validity['nonmonotone_segs'])
+            self.axs[0].set_title(f'Invalid boundary: {nx} self-intersections, {nf} folded segments', 
+                                  fontsize=9, color='orange')
+
         self.canvas.draw()                 
 
     def save_file(self, d):
@@ -467,6 +711,8 @@ class App:
         s = json.load(f)
         shape_params = s['shape_params']
         seg_params = s['seg_params']
+        if 'history' in s:
+            self.history = ShapeHistory.from_dict(s['history'], self.seg_tracker)
 
         for key in shape_params.keys():
             try:                
@@ -481,31 +727,71 @@ class App:
                 self.seg_params[key].set(strval)
             except:
                 pass
+
+        # the saved history's current state has the entry texts as they were typed
+        if 'history' in s:
+            state = self.history.current
+            for key, val in state['shape_params'].items():
+                self.shape_params[key].set(val)
+            for key, val in state['seg_params'].items():
+                self.seg_params[key].set(val)
        
         self.update_plots()
         print('Shape loaded successfully.')  
 
 
+    def fit_boundary(self, event=None):
+        """
+        METHOD: fit_boundary
+        DESCRIPTION: fit the shape parameters to a target boundary file and
+        load the result into the shape parameter fields
+        """
+        filetypes=[("JSON files","*.json"), ("Text Documents","*.txt"), ("All Files","*.*")]
+        fn = tk.filedialog.askopenfilename(filetypes=filetypes)
+        if not fn:
+            return
+
+        # perturbed shapes in the worker pool, unless it is busy with a scan
+        scanning = self.scan is not None and len(self.scan['futures']) > 0
+        pool = None if scanning else self.worker_pool()
+        try:
+            rt, zt = load_boundary(fn)
+            sfit, res = fit_shape(rt, zt, pool=pool)
+        except Exception as e:
+            print(f'Shape fit failed: {e!r}')
+            return
+
+        for key in sfit.keys():
+            self.shape_params[key].set(f'{sfit[key]:.4g}')
+
+        self.update_plots()
+        rms = np.sqrt(np.mean(res.fun**2))
+        print(f'Shape fit converged in {res.nfev} evaluations, rms boundary distance {rms:.2e} m.')
+
+
     def save_shape(self, event=None):
 
-        shape_params = self.tkdict2dict(self.shape_params)     # convert values form Tk-formatted shape_params to a normal python dict    
-        shape_params = self.add_aux_geom_params(shape_params)
         seg_params = self.tkdict2dict(self.seg_params)
-        
-        rb, zb = shape_create_deadstart(shape_params)          # create boundary shape from params
-        segs = self.get_segs()                                 # get control segments
-        rcp, zcp = self.seg_intersections(segs, rb, zb)        # get control points
+        self.history.record(self.tkdict2str(self.shape_params), self.tkdict2str(self.seg_params))
+
+        # shape params with aux params, boundary, control segments and points, 
+        # self-intersections and folds (from the history cache if already computed)
+        shape_params, b, segs, rcp, zcp, validity = self.history.results()
+        rb, zb = b
               
         # put everthing in dict        
         shape_params['rb'] = rb.tolist()
         shape_params['zb'] = zb.tolist()
+        # compact spline form of the boundary, stored next to rb/zb which the MATLAB tools read
+        shape_params['boundary_spline'] = BoundarySpline.from_boundary(b).to_dict()
         shape_params['segs'] = segs.tolist()
         shape_params['rcp'] = rcp.tolist()
         shape_params['zcp'] = zcp.tolist()
+        shape_params['validity'] = {key: np.asarray(val).tolist() for key, val in validity.items()}
         shape_params['rl'] = self.rl
         shape_params['zl'] = self.zl
         
-        d = {'shape_params':shape_params, 'seg_params':seg_params}
+        d = {'shape_params':shape_params, 'seg_params':seg_params, 'history':self.history.to_dict()}
         self.save_file(d)      
         print('Shape saved to file successfully.')  
 
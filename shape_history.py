@@ -0,0 +1,166 @@
+import numpy as np
+from shape_callbacks import shape_create_deadstart, add_aux_geom_params, seg_intersections, check_boundary, get_segs
+
+"""
+Undo/redo history of the shape editor. A state is a snapshot of the entry
+texts of the shape and segment parameters. The computed results are cached
+per parameter set rather than per state: the boundary (and its validity) is
+keyed by the shape parameters, the control segments by the segment
+parameters and the control points by both. States that share parameters
+share the same (read-only) arrays, e.g. an edit of a segment parameter
+reuses the boundary of the previous state, and cache entries are dropped
+once no state in the history refers to them.
+"""
+
+
+def _params_key(strvals):
+    """hashable key of the numeric values of a snapshot, non-numeric values are nan (None)"""
+    key = []
+    for k in sorted(strvals):
+        try:
+            v = float(strvals[k])
+        except ValueError:
+            v = np.nan
+        key.append((k, None if np.isnan(v) else v))
+    return tuple(key)
+
+
+def _floats(key):
+    return {k: (np.nan if v is None else v) for k, v in key}
+
+
+def _readonly(*arrays):
+    for a in arrays:
+        a.setflags(write=False)
+
+
+class ShapeHistory:
+    """
+    CLASS: ShapeHistory
+    DESCRIPTION: bounded undo/redo stack of parameter snapshots with a cache
+    of the computed boundaries, control segments and control points
+    """
+
+    def __init__(self, maxlen=200, tracker=None):
+        self.maxlen = maxlen
+        self.tracker = tracker  # SegTracker for the control points, optional
+        self.states = []
+        self.index = -1
+        self._boundaries = {}   # shape key -> (s, boundary, validity)
+        self._segs = {}         # seg key -> segs
+        self._cps = {}          # (shape key, seg key) -> (rcp, zcp)
+
+    @property
+    def current(self):
+        return self.states[self.index] if self.states else None
+
+    @property
+    def can_undo(self):
+        return self.index > 0
+
+    @property
+    def can_redo(self):
+        return self.index < len(self.states) - 1
+
+    def record(self, shape_params, seg_params):
+        """
+        Add a snapshot ({key: entry text}) as the new current state, unless it
+        has the same values as the current state ('60' and '60.0' are the 
+        same). Redo states are discarded and the oldest states are dropped 
+        beyond maxlen. Returns True if recorded.
+        """
+        state = {'shape_params': dict(shape_params), 'seg_params': dict(seg_params)}
+        if self.current is not None and self._keys(state) == self._keys(self.current):
+            return False
+        del self.states[self.index+1:]
+        self.states.append(state)
+        del self.states[:-self.maxlen]
+        self.index = len(self.states) - 1
+        self._prune()
+        return True
+
+    @staticmethod
+    def _keys(state):
+        return _params_key(state['shape_params']), _params_key(state['seg_params'])
+
+    def undo(self):
+        """step back, returns the state to restore or None"""
+        if not self.can_undo:
+            return None
+        self.index -= 1
+        return self.current
+
+    def redo(self):
+        """step forward, returns the state to restore or None"""
+        if not self.can_redo:
+            return None
+        self.index += 1
+        return self.current
+
+    def results(self, state=None):
+        """
+        Shape parameters (with aux params), boundary, control segments,
+        control points and validity of a state (default: current state).
+        Only what is not cached yet is computed.
+        """
+        state = state or self.current
+        skey = _params_key(state['shape_params'])
+        pkey = _params_key(state['seg_params'])
+
+        if skey not in self._boundaries:
+            s = add_aux_geom_params(_floats(skey))
+            b = shape_create_deadstart(s)
+            validity = check_boundary(b)
+            _readonly(b.rz, *[v for v in validity.values() if isinstance(v, np.ndarray)])
+            self._boundaries[skey] = (s, b, validity)
+        s, b, validity = self._boundaries[skey]
+
+        if pkey not in self._segs:
+            segs = get_segs(_floats(pkey))
+            _readonly(segs)
+            self._segs[pkey] = segs
+        segs = self._segs[pkey]
+
+        if (skey, pkey) not in self._cps:
+            rcp, zcp = seg_intersections(segs, b, tracker=self.tracker)
+            _readonly(rcp, zcp)
+            self._cps[(skey, pkey)] = (rcp, zcp)
+        rcp, zcp = self._cps[(skey, pkey)]
+
+        return dict(s), b, segs, rcp, zcp, validity
+
+    def add_boundary(self, state, s, b, validity=None):
+        """
+        Put an already computed boundary (e.g. from a scan) into the cache
+        for the shape parameters of state.
+        """
+        skey = _params_key(state['shape_params'])
+        if skey not in self._boundaries:
+            validity = validity if validity is not None else check_boundary(b)
+            _readonly(b.rz, *[v for v in validity.values() if isinstance(v, np.ndarray)])
+            self._boundaries[skey] = (dict(s), b, validity)
+
+    def _prune(self):
+        """drop cached results that no state refers to"""
+        skeys = {_params_key(st['shape_params']) for st in self.states}
+        pkeys = {_params_key(st['seg_params']) for st in self.states}
+        for key in set(self._boundaries) - skeys:
+            del self._boundaries[key]
+        for key in set(self._segs) - pkeys:
+            del self._segs[key]
+        for key in [k for k in self._cps if k[0] not in skeys or k[1] not in pkeys]:
+            del self._cps[key]
+
+    def to_dict(self):
+        """snapshots and position, for saving with a shape (results are recomputed on demand)"""
+        return {'states': self.states, 'index': self.index, 'maxlen': self.maxlen}
+
+    @classmethod
+    def from_dict(cls, d, tracker=None):
+        h = cls(d.get('maxlen', 200), tracker)
+        states = [{'shape_params': dict(st['shape_params']), 'seg_params': dict(st['seg_params'])}
+                  for st in d['states']]
+        ndrop = max(len(states) - h.maxlen, 0)
+        h.states = states[ndrop:]
+        h.index = min(max(d['index'] - ndrop, 0), len(h.states) - 1)
+        return h
@@ -0,0 +1,251 @@
+import numpy as np
+import os
+import json
+import html
+import urllib.parse
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from shape_callbacks import shape_create_deadstart, add_aux_geom_params, seg_intersections, check_boundary, get_segs, rlim, zlim
+
+"""
+Plot layout shared with the GUI, and headless (Agg) rendering of shape
+catalogs to PNG thumbnails, drawn the same way as App.update_plots. Each
+worker process reuses one figure and only updates the data of its artists.
+
+usage: python shape_render.py shapes/*.json --out thumbnails [--dpi 50] [--workers 4]
+
+Writes one PNG per shape file (named by its path relative to the common
+directory of the files) and a contact sheet, index.html, in --out. Shapes
+that fail to load or render are listed with their error on the sheet.
+"""
+
+
+def setup_axes(fig):
+    """
+    Shape axes: full view on the left, upper and lower divertor on the right.
+    """
+    axs = [None]*3
+    axs[0] = fig.add_subplot(2,2,(1,3))
+    axs[1] = fig.add_subplot(2,2,2)
+    axs[2] = fig.add_subplot(2,2,4)
+
+    for i in range(3):
+        axs[i].grid(visible=True)
+        if i == 0:
+            axs[i].set_ylabel('Z [m]', fontsize=12)
+        if i in (0,2):
+            axs[i].set_xlabel('R [m]', fontsize=12)
+        if i == 1:
+            axs[i].xaxis.set_ticklabels([])
+
+    axs[0].set_xlim((1.2, 2.5))
+    axs[0].set_ylim((-1.7, 1.7))
+    axs[1].set_xlim((1.3, 1.85))
+    axs[1].set_ylim((1.1, 1.6))
+    axs[2].set_xlim((1.3, 1.85))
+    axs[2].set_ylim((-1.6, -1.1))
+
+    fig.tight_layout()
+    return axs
+
+
+def invalid_regions(rb, zb, validity):
+    """
+    (r,z) of the boundary sections that are folded or form a loop between
+    two self-intersecting segments (see check_boundary), separated by nans
+    """
+    n = len(rb) - 1
+    idx = []
+    for (i, j) in validity['self_intersection_segs']:
+        # the loop is the shorter way around between the two segments
+        if j - i <= n // 2:
+            idx.append(np.arange(i, j+2))
+        else:
+            idx.append(np.r_[np.arange(j, n), np.arange(0, i+2)])
+    for k in validity['nonmonotone_segs']:
+        idx.append(np.array([k, k+1]))
+
+    r, z = [], []
+    for i in idx:
+        r += list(np.take(rb, i, mode='wrap')) + [np.nan]
+        z += list(np.take(zb, i, mode='wrap')) + [np.nan]
+    return r, z
+
+
+class ShapeRenderer:
+    """
+    CLASS: ShapeRenderer
+    DESCRIPTION: one Agg figure with the shape axes and their artists,
+    which are updated in place for each shape that is rendered
+    """
+
+    def __init__(self, dpi=50):
+        self.fig = Figure(figsize = (6,6), dpi = dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.axs = setup_axes(self.fig)
+        self.title = self.fig.suptitle('', fontsize=10)
+
+        self.artists = []
+        for ax in self.axs:
+            ax.plot(rlim, zlim, linewidth=1.5, color='black')
+            a = {}
+            a['boundary'], = ax.plot([], [], linewidth=1, color='red')
+            a['invalid'], = ax.plot([], [], linewidth=3, color='orange', alpha=0.8)
+            a['crossings'], = ax.plot([], [], linestyle='none', marker='o', ms=np.sqrt(40), color='orange')
+            a['manual_pts'], = ax.plot([], [], linestyle='none', marker='o', ms=np.sqrt(15), color='blue')
+            a['xpts'], = ax.plot([], [], linestyle='none', marker='x', ms=np.sqrt(50), color='red')
+            a['control_pts'], = ax.plot([], [], linestyle='none', marker='.', ms=np.sqrt(15), color='blue')
+            a['segs'] = LineCollection([], colors='blue', alpha=0.3, linewidths=0.5)
+            ax.add_collection(a['segs'])
+            self.artists.append(a)
+
+    def render(self, s, rb, zb, segs, rcp, zcp, validity, fn, title=''):
+        """
+        Draw one shape and save it to fn. s holds the manual points and
+        x-points (r1, z1, ..., rx1, zx1, ...).
+        """
+        rinv, zinv = invalid_regions(rb, zb, validity)
+        rman = [s.get(f'r{k+1}', np.nan) for k in range(8)]
+        zman = [s.get(f'z{k+1}', np.nan) for k in range(8)]
+        rx = [s.get(f'rx{k+1}', np.nan) for k in range(4)]
+        zx = [s.get(f'zx{k+1}', np.nan) for k in range(4)]
+        seglines = np.stack((segs[:,[0,1]], segs[:,[2,3]]), axis=1)
+
+        for a in self.artists:
+            a['boundary'].set_data(rb, zb)
+            a['invalid'].set_data(rinv, zinv)
+            a['crossings'].set_data(validity['r_self_intersections'], validity['z_self_intersections'])
+            a['manual_pts'].set_data(rman, zman)
+            a['xpts'].set_data(rx, zx)
+            a['control_pts'].set_data(rcp, zcp)
+            a['segs'].set_segments(seglines)
+
+        self.title.set_text(title)
+        self.title.set_color('black' if validity['valid'] else 'orange')
+        self.fig.savefig(fn)
+
+
+def load_shape_file(fn):
+    """
+    Shape parameters, boundary, control segments and points, and validity
+    from a saved shape file. Anything that is not in the file is computed.
+    """
+    with open(fn) as f:
+        d = json.load(f)
+    s = d['shape_params']
+
+    if 'rb' in s and 'segs' in s and 'rcp' in s:
+        rb = np.asarray(s['rb'], dtype=float)
+        zb = np.asarray(s['zb'], dtype=float)
+        segs = np.asarray(s['segs'], dtype=float).reshape(-1, 4)
+        rcp = np.asarray(s['rcp'], dtype=float)
+        zcp = np.asarray(s['zcp'], dtype=float)
+    else:
+        b = shape_create_deadstart(add_aux_geom_params(dict(s)))
+        rb, zb = b
+        segs = get_segs(d['seg_params'])
+        rcp, zcp = seg_intersections(segs, b)
+
+    validity = s.get('validity') or check_boundary(rb, zb)
+    validity = {key: np.asarray(val) for key, val in validity.items()}
+    validity['valid'] = bool(validity['valid'])
+    return s, rb, zb, segs, rcp, zcp, validity
+
+
+_renderer = None
+
+def _init_worker(dpi):
+    global _renderer
+    _renderer = ShapeRenderer(dpi)
+
+
+def output_names(files):
+    """
+    Unique names for the shape files: the path relative to their common 
+    directory without extension, with '__' for the path separators
+    """
+    paths = [os.path.splitext(os.path.abspath(fn))[0] for fn in files]
+    root = os.path.commonpath([os.path.dirname(p) for p in paths]) if paths else ''
+    names = [os.path.relpath(p, root).replace(os.sep, '__') for p in paths]
+
+    # the same file listed twice (or a.json and a.txt)
+    seen = {}
+    for i, name in enumerate(names):
+        if name in seen:
+            seen[name] += 1
+            names[i] = f'{name}_{seen[name]}'
+        else:
+            seen[name] = 0
+    return names
+
+
+def render_file(fn, outdir, name):
+    """
+    render one shape file with the worker's renderer to outdir/name.png, 
+    returns the name, png name and validity (png None and the error if the 
+    shape could not be loaded or drawn)
+    """
+    png = name + '.png'
+    try:
+        shape = load_shape_file(fn)
+        _renderer.render(*shape, os.path.join(outdir, png), title=name)
+    except Exception as e:
+        return name, None, repr(e)
+    return name, png, shape[-1]['valid']
+
+
+def write_contact_sheet(outdir, results, ncols=6):
+    """index.html with all thumbnails in a grid, invalid shapes outlined in orange"""
+    cells = []
+    for name, png, valid in results:
+        name = html.escape(name)
+        if png is None:
+            cells.append(f'<div class="cell err">{name}<br>{html.escape(str(valid))}</div>')
+            continue
+        cls = 'cell' if valid else 'cell invalid'
+        src = html.escape(urllib.parse.quote(png))
+        cells.append(f'<div class="{cls}"><a href="{src}"><img src="{src}" loading="lazy"></a><br>{name}</div>')
+
+    with open(os.path.join(outdir, 'index.html'), 'w') as f:
+        f.write('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>Shape catalog</title>\n'
+                '<style>body{font-family:sans-serif} '
+                f'.grid{{display:grid;grid-template-columns:repeat({ncols},1fr);gap:6px}} '
+                '.cell{text-align:center;font-size:11px;border:2px solid transparent} '
+                '.cell img{width:100%} .invalid{border-color:orange} .err{color:red}</style>'
+                '</head><body>\n')
+        f.write(f'<p>{len(results)} shapes</p>\n<div class="grid">\n')
+        f.write('\n'.join(cells))
+        f.write('\n</div></body></html>\n')
+
+
+def render_catalog(files, outdir, dpi=50, workers=None, chunksize=16):
+    """
+    Render all shape files to outdir with a process pool and write the
+    contact sheet. Returns a list of (name, png, valid) in the order of files.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    workers = workers or multiprocessing.cpu_count()
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(dpi,)) as pool:
+        results = list(pool.map(render_file, files, [outdir]*len(files), output_names(files), chunksize=chunksize))
+    write_contact_sheet(outdir, results)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render shape files to PNG thumbnails and a contact sheet.')
+    parser.add_argument('files', nargs='+', help='saved shape files (.json)')
+    parser.add_argument('--out', default='thumbnails', help='output directory')
+    parser.add_argument('--dpi', type=int, default=50, help='resolution of the 6x6 inch figure')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: all cores)')
+    args = parser.parse_args()
+
+    results = render_catalog(args.files, args.out, args.dpi, args.workers)
+    nfailed = sum(png is None for _, png, _ in results)
+    print(f"{len(results) - nfailed} shapes rendered, {nfailed} failed, see {os.path.join(args.out, 'index.html')}.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import numpy as np
+from matplotlib.path import Path
+from shape_callbacks import shape_create_deadstart, add_aux_geom_params, seg_intersections, check_boundary, rlim, zlim
+from shape_fit import boundary_distance
+
+"""
+Two-parameter scans of the shape. Each grid point is evaluated independently
+by scan_point so that the grid can be spread over a process pool.
+"""
+
+scan_metrics = ['elongation', 'wall gap', 'control pt displacement', 'invalid segments']
+
+
+def scan_grid(key1, vals1, key2, vals2):
+    """
+    List of (i, j, {key1: vals1[i], key2: vals2[j]}) for every point of the grid.
+    """
+    return [(i, j, {key1: float(v1), key2: float(v2)})
+            for i, v1 in enumerate(vals1) for j, v2 in enumerate(vals2)]
+
+
+def shape_metrics(rb, zb, rcp, zcp, rcp0, zcp0):
+    """
+    Derived metrics of a boundary, compared against reference control points
+    (rcp0, zcp0). Wall gap is negative if the boundary leaves the limiter.
+    """
+    m = {}
+    m['elongation'] = (zb.max() - zb.min()) / (rb.max() - rb.min())
+
+    d = boundary_distance(rb, zb, np.asarray(rlim), np.asarray(zlim))
+    inside = Path(np.c_[rlim, zlim]).contains_points(np.c_[rb, zb])
+    m['wall gap'] = d.min() if inside.all() else -d[~inside].max()
+
+    dcp = np.sqrt((rcp - rcp0)**2 + (zcp - zcp0)**2)
+    m['control pt displacement'] = np.nanmax(dcp) if np.any(np.isfinite(dcp)) else np.nan
+
+    # self-intersecting and folded segments
+    v = check_boundary(rb, zb)
+    m['invalid segments'] = len(v['r_self_intersections']) + len(v['nonmonotone_segs'])
+    return m
+
+
+def scan_point(i, j, s, segs, rcp0, zcp0):
+    """
+    Evaluate one grid point of a scan. s is the full shape parameter dict for
+    this point. Returns the grid indices, metrics and the computed shape.
+    """
+    s = add_aux_geom_params(dict(s))
+    try:
+        b = shape_create_deadstart(s)
+        rcp, zcp = seg_intersections(segs, b)
+        rb, zb = b
+        m = shape_metrics(rb, zb, rcp, zcp, rcp0, zcp0)
+    except Exception:
+        # the shape could not be created for these parameters
+        rb = zb = rcp = zcp = None
+        m = {key: np.nan for key in scan_metrics}
+
+    return i, j, m, (s, rb, zb, segs, rcp, zcp)
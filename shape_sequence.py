@@ -0,0 +1,129 @@
+import numpy as np
+import json
+import argparse
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from shape_callbacks import shape_create_deadstart, add_aux_geom_params, seg_intersections, check_boundary, get_segs
+
+"""
+Shape sequences: shapes at many time slices, interpolated between a few
+keyframe shapes saved from the GUI. Slices are computed in a process pool
+and streamed in time order, with a bounded number of slices in flight, so
+memory does not grow with the length of the sequence.
+
+usage: python shape_sequence.py 0.0:shapes/a.json 1.5:shapes/b.json --times 0 1.5 1000 --out seq.jsonl
+
+The output has one JSON object per line (per time slice) with t, the
+interpolated shape_params and seg_params, rb, zb, rcp, zcp and valid.
+"""
+
+
+def load_keyframes(specs):
+    """
+    Keyframes from a list of 'time:file' strings (saved shape files), sorted
+    by time. Returns a list of (t, shape_params, seg_params).
+    """
+    keyframes = []
+    for spec in specs:
+        t, fn = spec.split(':', 1)
+        with open(fn) as f:
+            d = json.load(f)
+        keyframes.append((float(t), d['shape_params'], d['seg_params']))
+    return sorted(keyframes, key=lambda k: k[0])
+
+
+def interpolate_params(keyframes, t, index):
+    """
+    Linear interpolation in time of the scalar parameters at index (1 for
+    shape_params, 2 for seg_params) of the keyframes. Outside the keyframe
+    times the first/last keyframe is used. The number of segments is not
+    interpolated but taken from the previous keyframe.
+    """
+    tk = np.array([k[0] for k in keyframes])
+    dicts = [k[index] for k in keyframes]
+    keys = [key for key, val in dicts[0].items()
+            if np.isscalar(val) and all(np.isscalar(d.get(key)) for d in dicts)]
+
+    p = {}
+    for key in keys:
+        vals = np.array([d[key] for d in dicts], dtype=float)
+        if key == 'nsegs':
+            p[key] = vals[max(np.searchsorted(tk, t, side='right') - 1, 0)]
+        else:
+            p[key] = float(np.interp(t, tk, vals))
+    return p
+
+
+def create_slices(tasks):
+    """
+    Compute a chunk of time slices, tasks is a list of (t, shape_params, seg_params).
+    """
+    out = []
+    for t, s, p in tasks:
+        b = shape_create_deadstart(add_aux_geom_params(dict(s)))
+        rcp, zcp = seg_intersections(get_segs(p), b)
+        out.append({'t': t, 'shape_params': s, 'seg_params': p, 'rb': b.r, 'zb': b.z,
+                    'rcp': rcp, 'zcp': zcp, 'valid': check_boundary(b)['valid']})
+    return out
+
+
+def shape_sequence(keyframes, times, workers=None, chunksize=8):
+    """
+    Generator of the time slices (dicts, see create_slices) in the order of
+    times. At most 2 chunks per worker are queued or in flight at a time.
+    """
+    workers = workers or multiprocessing.cpu_count()
+
+    def chunks():
+        for i in range(0, len(times), chunksize):
+            yield [(float(t), interpolate_params(keyframes, t, 1), interpolate_params(keyframes, t, 2))
+                   for t in times[i:i+chunksize]]
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for chunk in chunks():
+            pending.append(pool.submit(create_slices, chunk))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def write_sequence(fn, slices):
+    """
+    Write time slices to fn as they arrive, one JSON object per line.
+    Returns the number of slices written.
+    """
+    n = 0
+    with open(fn, 'w') as f:
+        for d in slices:
+            d = {key: (val.tolist() if isinstance(val, np.ndarray) else val) for key, val in d.items()}
+            f.write(json.dumps(d) + '\n')
+            n += 1
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shape sequence interpolated between keyframe shapes.')
+    parser.add_argument('keyframes', nargs='+', help='keyframes as time:shape_file.json')
+    parser.add_argument('--times', nargs=3, type=float, metavar=('T0', 'T1', 'N'),
+                        help='time base, N times from T0 to T1')
+    parser.add_argument('--timefile', help='time base, text file with one time per line')
+    parser.add_argument('--out', default='sequence.jsonl')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: all cores)')
+    args = parser.parse_args()
+
+    keyframes = load_keyframes(args.keyframes)
+    if args.timefile:
+        times = np.loadtxt(args.timefile, ndmin=1)
+    elif args.times:
+        times = np.linspace(args.times[0], args.times[1], int(args.times[2]))
+    else:
+        times = np.array([k[0] for k in keyframes])
+
+    n = write_sequence(args.out, shape_sequence(keyframes, times, args.workers))
+    print(f'{n} time slices written to {args.out}.')
+
+if __name__ == '__main__':
+    main()
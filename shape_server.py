@@ -0,0 +1,164 @@
+import numpy as np
+import json
+import struct
+import argparse
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from shape_callbacks import shape_create_deadstart, add_aux_geom_params, seg_intersections, check_boundary, get_segs, default_seg_params
+
+"""
+Local shape generation service, so that external tools (e.g. MATLAB, see
+request_shapes.m) can get shapes without starting a new python process for
+each one. Shapes are computed in a pool of worker processes that are warmed
+up when the server starts.
+
+usage: python shape_server.py [--port 8765] [--workers 4]
+
+POST /shapes with a JSON body that is one shape or a list of shapes (batch).
+A shape is either a saved shape file ({'shape_params': ..., 'seg_params': ...})
+or just the shape parameters, in which case the default control segments of
+the GUI are used. Control segments can also be given directly as 'segs'
+(list of [R0, Z0, Rf, Zf]). nulls are read as nan.
+
+The response is binary (little-endian) unless the request has ?format=json:
+    char[4]  'SHP1'
+    uint32   number of shapes
+    for each shape:
+        uint32   nb, nsegs, valid
+        float64  rb[nb], zb[nb], segs[nsegs*4] (row-major), rcp[nsegs], zcp[nsegs]
+"""
+
+
+def _nan_for_none(d):
+    return {key: (np.nan if val is None else val) for key, val in d.items()}
+
+
+def create_shape(item):
+    """
+    Boundary (M,2), control segments, control points and validity of the
+    boundary for one shape of a request.
+    """
+    s = add_aux_geom_params(_nan_for_none(item.get('shape_params', item)))
+    b = shape_create_deadstart(s)
+
+    if 'segs' in item:
+        segs = np.asarray(item['segs'], dtype=float).reshape(-1, 4)
+    else:
+        segs = get_segs(_nan_for_none(item.get('seg_params', default_seg_params)))
+
+    rcp, zcp = seg_intersections(segs, b)
+    valid = check_boundary(b)['valid']
+    return b.rz, segs, rcp, zcp, valid
+
+
+def pack_shapes(shapes):
+    """binary response, see the module description"""
+    parts = [b'SHP1', struct.pack('<I', len(shapes))]
+    for rz, segs, rcp, zcp, valid in shapes:
+        parts.append(struct.pack('<3I', len(rz), len(segs), int(valid)))
+        parts.append(np.concatenate((rz[:,0], rz[:,1], segs.ravel(), rcp, zcp)).astype('<f8').tobytes())
+    return b''.join(parts)
+
+
+def unpack_shapes(data):
+    """inverse of pack_shapes, list of dicts with rb, zb, segs, rcp, zcp, valid"""
+    if data[:4] != b'SHP1':
+        raise ValueError(f'not a shape response, starts with {data[:4]!r}')
+    n, = struct.unpack_from('<I', data, 4)
+    pos = 8
+    shapes = []
+    for _ in range(n):
+        nb, nsegs, valid = struct.unpack_from('<3I', data, pos)
+        pos += 12
+        vals = np.frombuffer(data, dtype='<f8', count=2*nb + 6*nsegs, offset=pos)
+        pos += vals.nbytes
+        shapes.append({'rb': vals[:nb], 'zb': vals[nb:2*nb],
+                       'segs': vals[2*nb:2*nb+4*nsegs].reshape(nsegs, 4),
+                       'rcp': vals[2*nb+4*nsegs:2*nb+5*nsegs], 'zcp': vals[2*nb+5*nsegs:],
+                       'valid': bool(valid)})
+    return shapes
+
+
+def shapes_to_json(shapes):
+    def tolist(x):
+        return [None if np.isnan(v) else v for v in np.asarray(x, dtype=float).tolist()]
+    d = [{'rb': tolist(rz[:,0]), 'zb': tolist(rz[:,1]), 'segs': [tolist(seg) for seg in segs],
+          'rcp': tolist(rcp), 'zcp': tolist(zcp), 'valid': bool(valid)}
+         for rz, segs, rcp, zcp, valid in shapes]
+    return json.dumps(d).encode()
+
+
+def _warm_worker():
+    """import and run the shape code once, so the first request is fast"""
+    create_shape({'Zup': 1.14, 'Zlo': -1.14, 'Rout': 2.4, 'Rin': 1.28, 'triu': 0.59, 'tril': 0.59,
+                  'squo': -0.22, 'squi': -0.37, 'sqlo': -0.22, 'sqli': -0.37, 'c_xplo': 0.07, 'c_xpup': 0.07})
+
+
+class ShapeRequestHandler(BaseHTTPRequestHandler):
+    """
+    CLASS: ShapeRequestHandler
+    DESCRIPTION: handles POST /shapes, the shapes are computed in the worker
+    pool of the server (self.server.pool)
+    """
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip('/') != '/shapes':
+            self.send_error(404)
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            items = body if isinstance(body, list) else [body]
+            chunksize = max(1, len(items) // (4 * self.server.nworkers))
+            shapes = self.server.pool.map(create_shape, items, chunksize=chunksize)
+        except Exception as e:
+            self.send_error(400, explain=repr(e))
+            return
+
+        if parse_qs(url.query).get('format', [''])[0] == 'json':
+            data, content_type = shapes_to_json(shapes), 'application/json'
+        else:
+            data, content_type = pack_shapes(shapes), 'application/octet-stream'
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(port=8765, workers=None, verbose=False):
+    """
+    Start the worker pool and serve requests on localhost until interrupted.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    with multiprocessing.Pool(workers, initializer=_warm_worker) as pool:
+        server = ThreadingHTTPServer(('127.0.0.1', port), ShapeRequestHandler)
+        server.pool = pool
+        server.nworkers = workers
+        server.verbose = verbose
+        print(f'Shape server listening on http://127.0.0.1:{port}/shapes with {workers} workers.')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local shape generation service.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: all cores)')
+    parser.add_argument('--verbose', action='store_true', help='log each request')
+    args = parser.parse_args()
+    serve(args.port, args.workers, args.verbose)
+
+if __name__ == '__main__':
+    main()
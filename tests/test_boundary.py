@@ -0,0 +1,44 @@
+import json
+import numpy as np
+from boundary import BoundarySpline
+from shape_callbacks import shape_create_deadstart, add_aux_geom_params, seg_intersections, get_segs, default_seg_params
+from shape_fit import boundary_distance
+
+tol = 5e-4
+
+
+def _shapes():
+    s0 = dict(Zup=1.14, Zlo=-1.14, Rout=2.4, Rin=1.28, triu=0.59, tril=0.59, squo=-0.22, squi=-0.37,
+              sqlo=-0.22, sqli=-0.37, c_xplo=0.07, c_xpup=0.07)
+    yield shape_create_deadstart(add_aux_geom_params(dict(s0)))
+    yield shape_create_deadstart(add_aux_geom_params(dict(s0, triu=0.3, tril=0.7, squo=0.2, sqli=-0.5, c_xplo=0.2)))
+
+
+def test_spline_error_is_bounded():
+    for b in _shapes():
+        sp = BoundarySpline.from_boundary(b, tol=tol)
+        assert sp.err <= tol
+
+        rz = sp(np.linspace(0, 1, 5000))
+        d = boundary_distance(rz[:,0], rz[:,1], b.r, b.z)
+        assert d.max() <= tol
+
+
+def test_spline_control_points():
+    segs = get_segs(default_seg_params)
+    for b in _shapes():
+        sp = BoundarySpline.from_boundary(b, tol=tol)
+        rcp, zcp = seg_intersections(segs, b)
+        rsp, zsp = seg_intersections(segs, sp)
+        assert np.array_equal(np.isnan(rcp), np.isnan(rsp))
+        assert np.nanmax(np.hypot(rsp - rcp, zsp - zcp)) <= 2*tol
+
+
+def test_spline_dict_round_trip():
+    b = next(_shapes())
+    sp = BoundarySpline.from_boundary(b, tol=tol)
+    sp2 = BoundarySpline.from_dict(json.loads(json.dumps(sp.to_dict())))
+    t = np.linspace(0, 1, 1000)
+    np.testing.assert_array_equal(sp2(t), sp(t))
+    np.testing.assert_array_equal(sp2.corners, sp.corners)
+    assert sp2.err == sp.err
@@ -0,0 +1,35 @@
+import numpy as np
+from intersections import self_intersection, _segment_intersection_
+
+
+def _brute_force(x, y):
+    """crossing segment pairs from testing all pairs that don't share an end point"""
+    n = len(x) - 1
+    ii, jj = np.triu_indices(n, k=2)
+    if x[0] == x[-1] and y[0] == y[-1]:
+        keep = ~((ii == 0) & (jj == n-1))
+        ii, jj = ii[keep], jj[keep]
+    T = _segment_intersection_(x, y, x, y, ii, jj)
+    in_range = (T[0] >= 0) & (T[1] >= 0) & (T[0] <= 1) & (T[1] <= 1)
+    return set(zip(ii[in_range].tolist(), jj[in_range].tolist()))
+
+
+def test_sweep_matches_brute_force():
+    rng = np.random.default_rng(0)
+    for k in range(300):
+        n = rng.integers(4, 80)
+        if k % 3 == 0:
+            # random walk
+            x, y = np.cumsum(rng.normal(size=(2, n)), axis=1)
+        else:
+            # noisy closed loop
+            th = np.sort(rng.uniform(0, 2*np.pi, n))
+            rad = 1 + rng.uniform(-0.5, 0.5, n) * (k % 2)
+            x, y = rad*np.cos(th) + 0.05*rng.normal(size=n), rad*np.sin(th)
+            x, y = np.append(x, x[0]), np.append(y, y[0])
+
+        xs, ys, i, j = self_intersection(x, y)
+        pairs = list(zip(i.tolist(), j.tolist()))
+        assert pairs == sorted(pairs)
+        assert set(pairs) == _brute_force(x, y)
+        assert len(xs) == len(ys) == len(pairs)
@@ -0,0 +1,54 @@
+import os
+import numpy as np
+from shape_callbacks import shape_create_deadstart, add_aux_geom_params, seg_intersections, get_segs, default_seg_params, SegTracker, check_boundary
+from boundary import Boundary
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def test_deadstart_matches_baseline():
+    # boundaries of the original (pre-Boundary) shape_create_deadstart, for the
+    # default shape and random shaping parameters; only rounding differences
+    # of the intersection solver are allowed
+    d = np.load(os.path.join(DATA, 'deadstart_baseline.npz'))
+    for p, rb, zb in zip(d['params'], d['rb'], d['zb']):
+        s = add_aux_geom_params(dict(zip(d['keys'].tolist(), p)))
+        r, z = shape_create_deadstart(s)
+        assert r.shape == rb.shape
+        np.testing.assert_allclose(r, rb, rtol=0, atol=1e-12)
+        np.testing.assert_allclose(z, zb, rtol=0, atol=1e-12)
+
+
+def _default_shape(**kw):
+    s = dict(Zup=1.14, Zlo=-1.14, Rout=2.4, Rin=1.28, triu=0.59, tril=0.59, squo=-0.22, squi=-0.37,
+             sqlo=-0.22, sqli=-0.37, c_xplo=0.07, c_xpup=0.07)
+    s.update(kw)
+    return shape_create_deadstart(add_aux_geom_params(s))
+
+
+def test_tracked_control_points_match_full_search():
+    # the manual segment crosses the boundary twice, the first crossing along
+    # the boundary switches sides while the shape moves up and while the start
+    # point of the boundary moves (by less than the tracking window)
+    segs = np.vstack((get_segs(default_seg_params), [[1.0, 0.02, 2.6, 0.02]]))
+    for shift in (0, 1, -1):
+        tracker = SegTracker()
+        for k, dz in enumerate(np.arange(0, 0.1, 0.01)):
+            b = _default_shape(Zup=1.14 + dz, Zlo=-1.14 + dz)
+            rz = np.roll(b.rz[:-1], shift * k, axis=0)
+            b = Boundary(np.r_[rz, rz[:1]])
+
+            rcp, zcp = seg_intersections(segs, b)
+            rtrk, ztrk = seg_intersections(segs, b, tracker=tracker)
+            np.testing.assert_array_equal(rtrk, rcp)
+            np.testing.assert_array_equal(ztrk, zcp)
+        assert tracker.stats['local'] > 0
+
+
+def test_check_boundary():
+    assert check_boundary(_default_shape())['valid']
+
+    # strongly negative squareness folds the upper boundary over itself
+    v = check_boundary(_default_shape(squo=-0.9, squi=-0.9))
+    assert not v['valid']
+    assert len(v['nonmonotone_segs']) > 0
@@ -0,0 +1,54 @@
+import json
+from shape_history import ShapeHistory
+
+shape_params = {'Zup': '1.14', 'Zlo': '-1.14', 'Rout': '2.4', 'Rin': '1.28', 'triu': '0.59', 'tril': '0.59',
+                'squo': '-0.22', 'squi': '-0.37', 'sqlo': '-0.22', 'sqli': '-0.37', 'c_xplo': '0.07', 'c_xpup': '0.07',
+                'rx1': 'nan', 'zx1': 'nan', 'r1': 'nan', 'z1': 'nan'}
+seg_params = {'rc': '1.75', 'zc': '0', 'a': '0.15', 'b': '0.2', 'seglength': '6', 'nsegs': '60', 'theta0': '0'}
+
+
+def test_same_values_are_not_recorded():
+    h = ShapeHistory()
+    assert h.record(shape_params, seg_params)
+    assert not h.record(shape_params, dict(seg_params, nsegs='60.0', zc='0.0'))
+    assert h.record(dict(shape_params, triu='0.5'), seg_params)
+    assert len(h.states) == 2
+
+
+def test_history_survives_save_and_load():
+    h = ShapeHistory()
+    for triu in ['0.59', '0.5', '0.4']:
+        h.record(dict(shape_params, triu=triu), seg_params)
+    h.undo()
+
+    # what load_shape does: restore the history, then record the loaded values
+    # (the saved file has them as floats)
+    h2 = ShapeHistory.from_dict(json.loads(json.dumps(h.to_dict())))
+    loaded = {key: str(float(val)) for key, val in h2.current['seg_params'].items()}
+    assert not h2.record(h2.current['shape_params'], loaded)
+    assert h2.states == h.states and h2.index == 1 and h2.can_redo
+    assert h2.redo()['shape_params']['triu'] == '0.4'
+
+
+def test_results_are_shared_between_states():
+    h = ShapeHistory()
+    h.record(shape_params, seg_params)
+    b0 = h.results()[1]
+    h.record(shape_params, dict(seg_params, nsegs='30'))
+    s, b, segs, rcp, zcp, validity = h.results()
+    assert b is b0 and len(segs) == 30
+    assert h.results(h.undo())[1] is b0
+
+
+def test_added_boundary_is_used():
+    # a boundary computed elsewhere (a scan point) is not computed again, the
+    # control points are for the segments of the state
+    h = ShapeHistory()
+    h.record(shape_params, seg_params)
+    s, b, *_ = h.results()
+
+    h2 = ShapeHistory()
+    h2.record(shape_params, dict(seg_params, nsegs='30'))
+    h2.add_boundary(h2.current, s, b)
+    s2, b2, segs, rcp, zcp, validity = h2.results()
+    assert b2 is b and len(segs) == len(rcp) == 30
@@ -0,0 +1,20 @@
+import re
+import html
+import urllib.parse
+from shape_render import write_contact_sheet, output_names
+
+
+def test_contact_sheet_links(tmp_path):
+    files = ['shapes/a #1.json', 'shapes/b "x" & y.json', "shapes/c's.json", 'shapes/d?.json']
+    names = output_names(files)
+    results = [(name, name + '.png', i % 2 == 0) for i, name in enumerate(names)]
+    results.append(('e<bad>', None, "ValueError('no shape')"))
+    write_contact_sheet(tmp_path, results)
+
+    text = (tmp_path / 'index.html').read_text()
+    hrefs = re.findall(r'href="([^"]*)"', text)
+    srcs = re.findall(r'src="([^"]*)"', text)
+    assert hrefs == srcs
+    assert [urllib.parse.unquote(html.unescape(h)) for h in hrefs] == [name + '.png' for name in names]
+    assert all(c not in h for h in hrefs for c in ' #?"\'<>')
+    assert '&lt;bad&gt;' in text and "ValueError(&#x27;no shape&#x27;)" in text
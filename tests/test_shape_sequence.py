@@ -0,0 +1,34 @@
+import numpy as np
+from shape_sequence import interpolate_params, shape_sequence
+
+shape_params = {'Zup': 1.14, 'Zlo': -1.14, 'Rout': 2.4, 'Rin': 1.28, 'triu': 0.59, 'tril': 0.59,
+                'squo': -0.22, 'squi': -0.37, 'sqlo': -0.22, 'sqli': -0.37, 'c_xplo': 0.07, 'c_xpup': 0.07,
+                'rb': [1.3, 2.4, 1.3]}
+seg_params = {'rc': 1.75, 'zc': 0.0, 'a': 0.15, 'b': 0.2, 'seglength': 6.0, 'nsegs': 60.0, 'theta0': 0.0}
+
+keyframes = [(1.0, shape_params, seg_params),
+             (3.0, dict(shape_params, triu=0.39, rb=[1.3, 2.3, 1.3]), dict(seg_params, nsegs=30.0, zc=0.2))]
+
+
+def test_interpolate_params():
+    s = interpolate_params(keyframes, 1.5, 1)
+    assert 'rb' not in s and 'Zup' in s
+    assert np.isclose(s['triu'], 0.54) and s['Zup'] == 1.14
+
+    # clamped to the first/last keyframe outside their times
+    assert interpolate_params(keyframes, -1, 1)['triu'] == 0.59
+    assert interpolate_params(keyframes, 5, 1)['triu'] == 0.39
+
+    # nsegs steps at the keyframe times, the other segment parameters are interpolated
+    p = [interpolate_params(keyframes, t, 2) for t in [0, 1, 2.9, 3, 4]]
+    assert [pi['nsegs'] for pi in p] == [60, 60, 60, 30, 30]
+    assert np.isclose(p[2]['zc'], 0.19)
+
+
+def test_sequence_keeps_time_order():
+    times = [4, -1, 1, 2, 2.5, 3, 1.5]
+    slices = list(shape_sequence(keyframes, times, workers=1, chunksize=2))
+    assert [d['t'] for d in slices] == times
+    assert [len(d['rcp']) for d in slices] == [30, 60, 60, 60, 60, 30, 60]
+    assert all(d['valid'] for d in slices)
+    assert np.isclose(slices[3]['shape_params']['triu'], 0.49)
@@ -0,0 +1,49 @@
+import os
+import json
+import numpy as np
+from shape_server import create_shape, pack_shapes, unpack_shapes, shapes_to_json
+import pytest
+
+SHAPES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'shapes')
+
+shape_params = {'Zup': 1.14, 'Zlo': -1.14, 'Rout': 2.4, 'Rin': 1.28, 'triu': 0.59, 'tril': 0.59,
+                'squo': -0.22, 'squi': -0.37, 'sqlo': -0.22, 'sqli': -0.37, 'c_xplo': 0.07, 'c_xpup': 0.07}
+
+
+def _items():
+    with open(os.path.join(SHAPES, 'shape1.json')) as f:
+        saved = json.load(f)
+    # the last segment misses the boundary, its control point is nan
+    segs = [[1.75, 0, 2.6, 0], [1.75, 0, 1.75, 1.8], [2.6, 1.6, 2.7, 1.7]]
+    return [shape_params, saved, {'shape_params': dict(shape_params, squo=-0.9, squi=-0.9), 'segs': segs}]
+
+
+def test_binary_round_trip():
+    shapes = [create_shape(item) for item in _items()]
+    assert [valid for *_, valid in shapes] == [True, True, False]
+    assert np.isnan(shapes[2][2][-1]) and not np.isnan(shapes[2][2][:-1]).any()
+
+    unpacked = unpack_shapes(pack_shapes(shapes))
+    assert len(unpacked) == len(shapes)
+    for (rz, segs, rcp, zcp, valid), u in zip(shapes, unpacked):
+        assert len(u['rb']) == len(rz) and len(u['segs']) == len(segs)
+        assert u['valid'] == valid
+        np.testing.assert_array_equal(u['rb'], rz[:,0])
+        np.testing.assert_array_equal(u['zb'], rz[:,1])
+        np.testing.assert_array_equal(u['segs'], segs)
+        np.testing.assert_array_equal(u['rcp'], rcp)  # nans in the same places
+        np.testing.assert_array_equal(u['zcp'], zcp)
+
+
+def test_json_has_null_for_nan():
+    shapes = [create_shape(item) for item in _items()]
+    d = json.loads(shapes_to_json(shapes))
+    assert d[2]['rcp'][-1] is None and d[2]['zcp'][-1] is None
+    assert None not in d[2]['rcp'][:-1]
+    assert [item['valid'] for item in d] == [True, True, False]
+    assert [len(item['segs']) for item in d] == [len(segs) for _, segs, *_ in shapes]
+
+
+def test_bad_magic():
+    with pytest.raises(ValueError):
+        unpack_shapes(b'SHP2' + pack_shapes([])[4:])